@@ -0,0 +1,195 @@
+import argparse
+import json
+import os
+import platform
+import random
+import tempfile
+import threading
+import time
+import tracemalloc
+from typing import Callable, List
+
+import keras
+import keras.backend as K
+import numpy as np
+
+from darwini import constants, training
+from darwini.breeder import Breeder
+from darwini.individuals.genome_batch import GenomeBatch
+from darwini.individuals.network import Network, blend_convs
+from darwini.telemetry import children_rss_mb, peak_rss_mb, reset_peak_rss
+
+
+def synthetic_data(samples: int, shape: List[int], classes_nbr: int, seed: int):
+    # Random images whose class shifts the mean intensity, so that models have something to learn
+    rng = np.random.RandomState(seed)
+    labels = rng.randint(0, classes_nbr, samples)
+    x = rng.rand(samples, *shape).astype(np.float32) * 0.5 + labels.reshape(-1, 1, 1, 1) * 0.5 / classes_nbr
+    return x, keras.utils.to_categorical(labels, classes_nbr)
+
+
+def timed(function: Callable, repeats: int) -> dict:
+    durations = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        function()
+        durations.append(time.perf_counter() - start)
+    durations = np.array(durations)
+    return {'calls': repeats, 'total_s': float(durations.sum()), 'mean_ms': float(durations.mean() * 1000),
+            'p95_ms': float(np.percentile(durations, 95) * 1000)}
+
+
+def benchmark_operators(shape: List[int], classes_nbr: int, population: int) -> dict:
+    networks = [Network.generate(shape, classes_nbr) for _ in range(population)]
+    pairs = [(random.choice(networks), random.choice(networks)) for _ in range(population)]
+    pair_iterator = iter(pairs * 2)
+    results = {
+        'generate': timed(lambda: Network.generate(shape, classes_nbr), population),
+        'blend': timed(lambda: Network.blend(*next(pair_iterator)), population),
+        'mutate': timed(lambda: random.choice(networks).mutate(), population),
+        'blend_convs': timed(lambda: blend_convs(*[network.conv_units for network in next(pair_iterator)]),
+                             population),
+        'validate': timed(lambda: random.choice(networks).validate(), population),
+        'genome_hash': timed(lambda: random.choice(networks).genome_hash(), population),
+    }
+    rng = np.random.default_rng(random.randrange(2 ** 32))
+    batch = GenomeBatch.generate(shape, classes_nbr, population, rng)
+    results['batch_generate'] = timed(lambda: GenomeBatch.generate(shape, classes_nbr, population, rng), 1)
+    results['batch_mutate'] = timed(lambda: batch.mutate(rng), 1)
+    results['batch_crossover'] = timed(lambda: batch.crossover(rng.integers(0, population, population),
+                                                               rng.integers(0, population, population), rng), 1)
+    results['batch_valid'] = timed(batch.valid, 1)
+    results['mean_conv_units'] = float(np.mean([len(network.conv_units) for network in networks]))
+    results['mean_dense_units'] = float(np.mean([len(network.dense_units) for network in networks]))
+    return results
+
+
+def benchmark_training(x, y, val_x, val_y, candidates: int, epochs: int) -> dict:
+    timings = {'compile_s': [], 'fit_s': [], 'evaluate_s': [], 'parameters': []}
+    for _ in range(candidates):
+        network = Network.generate(x.shape[1:], y.shape[-1])
+        start = time.perf_counter()
+        model = network.compile()
+        compiled = time.perf_counter()
+        model.fit(x, y, batch_size=constants.BATCH_SIZE, epochs=epochs, verbose=0)
+        fitted = time.perf_counter()
+        model.evaluate(val_x, val_y, verbose=0)
+        evaluated = time.perf_counter()
+        timings['compile_s'].append(compiled - start)
+        timings['fit_s'].append(fitted - compiled)
+        timings['evaluate_s'].append(evaluated - fitted)
+        timings['parameters'].append(network.parameter_count())
+        K.clear_session()
+    results = {name: {'mean': float(np.mean(values)), 'max': float(np.max(values))}
+               for name, values in timings.items()}
+    results['candidates'] = candidates
+    results['epochs'] = epochs
+    return results
+
+
+class ChildrenRssSampler:
+    # Worker processes are not in the breeder's own high-water mark, their summed resident set is sampled instead
+    interval: float
+    peak_mb: float
+
+    def __init__(self, interval: float = 0.2) -> None:
+        self.interval = interval
+        self.peak_mb = 0.
+        self.stop = threading.Event()
+        self.thread = threading.Thread(target=self.__sample, daemon=True)
+
+    def __sample(self) -> None:
+        while not self.stop.wait(self.interval):
+            self.peak_mb = max(self.peak_mb, children_rss_mb())
+
+    def __enter__(self) -> 'ChildrenRssSampler':
+        self.thread.start()
+        return self
+
+    def __exit__(self, *_) -> None:
+        self.stop.set()
+        self.thread.join()
+
+
+def benchmark_breeder(x, y, val_x, val_y, population: int, generations: int, seed: int, workers: int) -> dict:
+    Breeder.population_size = population
+    breeder = Breeder(x, y, val_x, val_y, seed=seed, workers=workers)
+    results = []
+    tracemalloc.start()
+    try:
+        for _ in range(generations):
+            previous_nbr = len(breeder.selected)
+            tracemalloc.reset_peak()
+            reset = reset_peak_rss()
+            start = time.perf_counter()
+            with ChildrenRssSampler() as workers_rss:
+                best = breeder.generation()
+            duration = time.perf_counter() - start
+            evaluated = len(breeder.population) - previous_nbr
+            # tracemalloc only sees the Python heap, TensorFlow's native memory only shows in the resident sets
+            results.append({'generation': breeder.generation_nbr, 'duration_s': duration, 'evaluated': evaluated,
+                            'candidates_per_hour': evaluated * 3600 / duration, 'best_score': float(best.score),
+                            'python_heap_peak_mb': tracemalloc.get_traced_memory()[1] / (1024 * 1024),
+                            'process_peak_rss_mb': peak_rss_mb(), 'process_peak_rss_reset': reset,
+                            'workers_peak_rss_mb': workers_rss.peak_mb})
+    finally:
+        tracemalloc.stop()
+        breeder.close()
+    return {'workers': workers, 'population': population, 'generations': results}
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Offline Darwini benchmarks on synthetic data")
+    parser.add_argument('--shape', type=int, nargs=3, default=[28, 28, 1], help="image shape, channels last")
+    parser.add_argument('--classes', type=int, default=10)
+    parser.add_argument('--samples', type=int, default=1024)
+    parser.add_argument('--operator-population', type=int, default=2000)
+    parser.add_argument('--training-candidates', type=int, default=5)
+    parser.add_argument('--population', type=int, default=10)
+    parser.add_argument('--generations', type=int, default=2)
+    parser.add_argument('--epochs', type=int, default=1)
+    parser.add_argument('--workers', type=int, default=0)
+    parser.add_argument('--seed', type=int, default=0)
+    parser.add_argument('--skip', nargs='*', default=[], choices=['operators', 'training', 'breeder'])
+    parser.add_argument('--output', default='benchmark.json')
+    args = parser.parse_args()
+    if args.population < Breeder.best_selected_nbr + 5:
+        parser.error("The breeder selects {} candidates, --population must be at least that".format(
+            Breeder.best_selected_nbr + 5))
+
+    constants.EPOCH_NBR = args.epochs
+    random.seed(args.seed)
+    training.seed_everything(args.seed)
+    x, y = synthetic_data(args.samples, args.shape, args.classes, args.seed)
+    val_x, val_y = synthetic_data(max(args.samples // 4, 1), args.shape, args.classes, args.seed + 1)
+
+    report = {'started': time.strftime('%Y-%m-%dT%H:%M:%S'), 'arguments': vars(args),
+              'python': platform.python_version(), 'keras': keras.__version__, 'numpy': np.__version__}
+    if 'operators' not in args.skip:
+        print("Benchmarking genetic operators")
+        report['operators'] = benchmark_operators(args.shape, args.classes, args.operator_population)
+    if 'training' not in args.skip:
+        print("Benchmarking candidate training")
+        report['training'] = benchmark_training(x, y, val_x, val_y, args.training_candidates, args.epochs)
+    # Generations reset the high-water mark, their peaks are in the breeder report
+    report['peak_rss_mb'] = peak_rss_mb()
+    if 'breeder' not in args.skip:
+        print("Benchmarking breeder generations")
+        output = os.path.abspath(args.output)
+        # The breeder saves the selected genomes in the working directory
+        working_dir = os.getcwd()
+        os.chdir(tempfile.mkdtemp(prefix='darwini_benchmark'))
+        try:
+            report['breeder'] = benchmark_breeder(x, y, val_x, val_y, args.population, args.generations,
+                                                  args.seed, args.workers)
+        finally:
+            os.chdir(working_dir)
+        args.output = output
+
+    with open(args.output, 'w') as file:
+        json.dump(report, file, indent=2)
+    print("Benchmark results written to {}".format(args.output))
+
+
+if __name__ == '__main__':
+    main()
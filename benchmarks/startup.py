@@ -0,0 +1,79 @@
+import argparse
+import json
+import platform
+import subprocess
+import sys
+import time
+
+# Each scenario runs in a fresh interpreter, which prints its import time, its total time and what it loaded
+PROBE = """
+import json, sys, time
+start = time.perf_counter()
+{imports}
+imported = time.perf_counter()
+{work}
+done = time.perf_counter()
+from darwini.telemetry import peak_rss_mb
+print(json.dumps({{'import_s': imported - start, 'total_s': done - start, 'peak_rss_mb': peak_rss_mb(),
+                  'keras_loaded': 'keras' in sys.modules, 'tensorflow_loaded': 'tensorflow' in sys.modules}}))
+"""
+
+GENOME_WORK = """
+import random
+networks = [Network.generate([28, 28, 1], 10) for _ in range(200)]
+children = [random.choice(networks).blend(random.choice(networks)).mutate() for _ in range(200)]
+hashes = [child.genome_hash() for child in children]
+genomes = [Network.from_dict(child.to_dict()) for child in children]
+"""
+
+COORDINATOR_WORK = """
+import numpy as np
+x, y = np.zeros((16, 28, 28, 1), dtype=np.float32), np.eye(10, dtype=np.float32)[np.arange(16) % 10]
+breeder = Breeder(x, y, x, y, pipeline=InputPipeline())
+""" + GENOME_WORK
+
+SCENARIOS = {
+    'interpreter': ('', ''),
+    'genome': ('from darwini.individuals.network import Network', GENOME_WORK),
+    'analysis': ('from darwini.individuals.network import Network\n'
+                 'from darwini import checkpoint, fitness_cache, pareto, surrogate', GENOME_WORK),
+    'keras': ('import keras', ''),
+    'breeder': ('from darwini.breeder import Breeder', ''),
+    'distributed': ('from darwini.distributed import DistributedEvaluator, main', ''),
+    'coordinator': ('from darwini.breeder import Breeder\nfrom darwini.distributed import DistributedEvaluator\n'
+                    'from darwini.individuals.network import Network\nfrom darwini.pipeline import InputPipeline',
+                    COORDINATOR_WORK),
+}
+
+
+def run_scenario(imports: str, work: str, repeats: int) -> dict:
+    runs = []
+    for _ in range(repeats):
+        output = subprocess.run([sys.executable, '-c', PROBE.format(imports=imports, work=work)], check=True,
+                                capture_output=True, text=True).stdout
+        runs.append(json.loads(output.strip().splitlines()[-1]))
+    # The fastest run is the one least disturbed by the rest of the machine
+    best = min(runs, key=lambda run: run['total_s'])
+    return dict(best, runs=repeats)
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Import time and memory of Darwini in fresh processes")
+    parser.add_argument('--repeats', type=int, default=3)
+    parser.add_argument('--scenarios', nargs='*', default=list(SCENARIOS), choices=list(SCENARIOS))
+    parser.add_argument('--output', default='startup.json')
+    args = parser.parse_args()
+
+    report = {'started': time.strftime('%Y-%m-%dT%H:%M:%S'), 'arguments': vars(args),
+              'python': platform.python_version(), 'scenarios': {}}
+    for name in args.scenarios:
+        report['scenarios'][name] = result = run_scenario(*SCENARIOS[name], args.repeats)
+        print("{:12} import {:6.2f}s\ttotal {:6.2f}s\tpeak RSS {:7.1f}MB\tKeras loaded:{}".format(
+            name, result['import_s'], result['total_s'], result['peak_rss_mb'], result['keras_loaded']))
+    with open(args.output, 'w') as file:
+        json.dump(report, file, indent=2)
+    print("Results written to {}".format(args.output))
+
+
+if __name__ == '__main__':
+    main()
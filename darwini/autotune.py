@@ -0,0 +1,119 @@
+import math
+import multiprocessing
+import time
+from concurrent.futures import ProcessPoolExecutor
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+
+from darwini import constants
+from darwini.individuals.network import Network
+
+
+def architecture_class(network: Network) -> str:
+    # Networks within a factor of two in compute and in size train at about the same speed
+    return 'macs:2^{}_params:2^{}'.format(round(math.log2(max(network.multiply_adds(), 1))),
+                                          round(math.log2(max(network.parameter_count(), 1))))
+
+
+def probe_throughput(network: Network, batch_size: int, steps: int = constants.AUTOTUNE_PROBE_STEPS,
+                     warmup: int = constants.AUTOTUNE_WARMUP_STEPS) -> float:
+    # Training samples per second on random data, the probe model is thrown away afterwards
+    rng = np.random.default_rng(0)
+    model = network.compile()
+    x = rng.random((batch_size,) + tuple(network.input_shape), dtype=np.float32)
+    y = np.eye(network.output_shape, dtype=np.float32)[rng.integers(0, network.output_shape, batch_size)]
+    for _ in range(warmup):
+        model.train_on_batch(x, y)
+    start = time.perf_counter()
+    for _ in range(steps):
+        model.train_on_batch(x, y)
+    return steps * batch_size / (time.perf_counter() - start)
+
+
+def _initialize_probe(threads: int) -> None:
+    import tensorflow as tf
+    tf.config.threading.set_intra_op_parallelism_threads(threads)
+    tf.config.threading.set_inter_op_parallelism_threads(1)
+
+
+class Autotuner:
+    batch_sizes: List[int]
+    min_batch_size: int
+    max_batch_size: int
+    probe_steps: int
+    warmup_steps: int
+    choices: Dict[str, dict]
+    threads: Optional[int]
+    thread_rates: Dict[int, float]
+
+    def __init__(self, batch_sizes: List[int] = None, min_batch_size: int = constants.AUTOTUNE_MIN_BATCH_SIZE,
+                 max_batch_size: int = constants.AUTOTUNE_MAX_BATCH_SIZE,
+                 probe_steps: int = constants.AUTOTUNE_PROBE_STEPS,
+                 warmup_steps: int = constants.AUTOTUNE_WARMUP_STEPS) -> None:
+        # The batch size changes what a candidate learns in its epochs, the limits keep it where training works well
+        batch_sizes = batch_sizes if batch_sizes is not None else constants.AUTOTUNE_BATCH_SIZES
+        self.batch_sizes = sorted(size for size in batch_sizes if min_batch_size <= size <= max_batch_size)
+        if not self.batch_sizes:
+            raise ValueError("No batch size of {} between {} and {}".format(batch_sizes, min_batch_size,
+                                                                            max_batch_size))
+        self.min_batch_size = min_batch_size
+        self.max_batch_size = max_batch_size
+        self.probe_steps = probe_steps
+        self.warmup_steps = warmup_steps
+        self.choices = {}
+        self.threads = None
+        self.thread_rates = {}
+
+    def batch_size(self, network: Network) -> Tuple[int, Optional[dict]]:
+        # Batch size of the network's class, along with the probe results when this call had to tune it
+        key = architecture_class(network)
+        if key in self.choices:
+            return self.choices[key]['batch_size'], None
+        rates = {str(size): probe_throughput(network, size, self.probe_steps, self.warmup_steps)
+                 for size in self.batch_sizes}
+        choice = {'batch_size': int(max(rates, key=rates.get)), 'samples_per_s': rates}
+        self.choices[key] = choice
+        return choice['batch_size'], choice
+
+    def default_batch_size(self) -> int:
+        return min(self.batch_sizes, key=lambda size: abs(size - constants.BATCH_SIZE))
+
+    def tune_threads(self, network: Network, workers: int) -> int:
+        # Thread counts only apply to a TensorFlow runtime that has not started yet, each count is probed with as many
+        # fresh processes running side by side as there will be workers
+        share = max(multiprocessing.cpu_count() // workers, 1)
+        options = sorted({2 ** i for i in range(int(math.log2(share)) + 1)} | {share})
+        batch_size = self.default_batch_size()
+        for threads in options:
+            with ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('spawn'),
+                                     initializer=_initialize_probe, initargs=(threads,)) as pool:
+                rates = pool.map(probe_throughput, [network] * workers, [batch_size] * workers,
+                                 [self.probe_steps] * workers, [self.warmup_steps] * workers)
+                self.thread_rates[threads] = sum(rates)
+        self.threads = max(self.thread_rates, key=self.thread_rates.get)
+        return self.threads
+
+    def record(self, key: str, choice: dict) -> None:
+        # Choices made in worker processes, kept for the reports
+        self.choices[key] = choice
+
+    def settings(self) -> dict:
+        return {'batch_sizes': self.batch_sizes, 'min_batch_size': self.min_batch_size,
+                'max_batch_size': self.max_batch_size, 'probe_steps': self.probe_steps,
+                'warmup_steps': self.warmup_steps}
+
+    def to_dict(self) -> dict:
+        return {'choices': self.choices, 'threads': self.threads,
+                'thread_rates': {str(threads): rate for threads, rate in self.thread_rates.items()}}
+
+    def restore(self, data: dict) -> None:
+        self.choices = data['choices']
+        self.threads = data['threads']
+        self.thread_rates = {int(threads): rate for threads, rate in data['thread_rates'].items()}
+
+    def __len__(self) -> int:
+        return len(self.choices)
+
+    def __str__(self) -> str:
+        return "Autotuner classes:{}\tthreads:{}".format(len(self.choices), self.threads)
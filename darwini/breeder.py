@@ -1,29 +1,116 @@
+import os
 import random
+import shutil
+import tempfile
+import math
+import time
+from concurrent.futures import FIRST_COMPLETED, wait
 from itertools import permutations
-from typing import List, Tuple
+from typing import TYPE_CHECKING, Callable, Dict, List, Optional, Tuple, Union
 
-import keras.backend as K
-from keras import Sequential
-from keras.callbacks import EarlyStopping
+import numpy as np
 from numpy.core.records import ndarray
 
-from darwini import constants
+from darwini import constants, training
+from darwini.autotune import Autotuner
+from darwini.candidate import Candidate
+from darwini.checkpoint import decode_population, decode_random_state, decode_results, encode_population, \
+    encode_random_state, encode_results, load_checkpoint, save_checkpoint
+from darwini.convergence import Convergence, diversity
+from darwini.dataset import Dataset
+from darwini.distributed import DistributedEvaluator
+from darwini.fitness_cache import FitnessCache
 from darwini.individuals.network import Network
+from darwini.parallel import ParallelEvaluator
+from darwini.pipeline import InputPipeline
+from darwini.pareto import ParetoSelection
+from darwini.successive_halving import SuccessiveHalving
+from darwini.surrogate import Surrogate, rank_correlation
+from darwini.telemetry import Telemetry, reset_peak_rss, rss_mb, score_summary
+
+if TYPE_CHECKING:
+    from darwini.latency import LatencyTable
+    from darwini.packing import ModelPacking
 
 
 class Breeder:
     population_size: int = 100
-    population: List[Tuple[int, Network, Sequential]]
-    selected: List[Tuple[int, Network, Sequential]]
-    train_x: ndarray
-    train_y: ndarray
-    val_x: ndarray
-    val_y: ndarray
+    best_selected_nbr: int = 5
+    population: List[Candidate]
+    selected: List[Candidate]
+    train_x: Union[ndarray, Dataset]
+    train_y: Optional[ndarray]
+    val_x: Union[ndarray, Dataset]
+    val_y: Optional[ndarray]
     generation_nbr: int = 0
     input_shape: List[int]
     output_shape: int
+    fitness_cache: Optional[FitnessCache]
+    evaluator: Optional[Union[ParallelEvaluator, DistributedEvaluator]]
+    seed: Optional[int]
+    halving: Optional[SuccessiveHalving]
+    inherit_weights: bool
+    curve_termination: bool
+    keep_weights: bool
+    weights_dir: str
+    temporary_weights_dir: bool
+    checkpoint_path: Optional[str]
+    checkpoint_interval: int
+    generation_state: dict
+    round_results: Dict[str, Tuple[str, Optional[Candidate]]]
+    resumed_results: Dict[str, Tuple[str, Optional[Candidate]]]
+    surrogate: Optional[Surrogate]
+    predictions: Dict[str, float]
+    telemetry: Telemetry
+    pareto: Optional[ParetoSelection]
+    latency: Optional['LatencyTable']
+    pipeline: Optional[InputPipeline]
+    autotuner: Optional[Autotuner]
+    packing: Optional['ModelPacking']
+    convergence: Optional[Convergence]
+    restore_best: bool
+    generation_failures: List[str]
+    generation_evaluated: int = 0
+    evaluated_nbr: int = 0
+    repaired_genomes: int = 0
+    rejected_genomes: int = 0
+    failed_trainings: int = 0
+    terminated_trainings: int = 0
+    generation_start: float = 0
+    spilled_nbr: int = 0
 
-    def __init__(self, train_x: ndarray, train_y: ndarray, val_x: ndarray, val_y: ndarray) -> None:
+    def __init__(self, train_x: Union[ndarray, Dataset], train_y: Optional[ndarray], val_x: Union[ndarray, Dataset],
+                 val_y: Optional[ndarray], fitness_cache: FitnessCache = None, workers: int = 0,
+                 threads_per_worker: int = None, seed: int = None, halving: SuccessiveHalving = None,
+                 inherit_weights: bool = False, curve_termination: bool = False, keep_weights: bool = False,
+                 weights_dir: str = None, checkpoint_path: str = None,
+                 checkpoint_interval: int = constants.CHECKPOINT_INTERVAL, surrogate: Surrogate = None,
+                 telemetry: Telemetry = None, pareto: ParetoSelection = None, latency: 'LatencyTable' = None,
+                 evaluator: Union[ParallelEvaluator, DistributedEvaluator] = None, restore_best: bool = False,
+                 pipeline: InputPipeline = None, autotuner: Autotuner = None, packing: 'ModelPacking' = None,
+                 convergence: Convergence = None) -> None:
+        if workers > 0 and evaluator is not None:
+            raise ValueError("Either let the breeder start worker processes or give it an evaluator, not both")
+        if pipeline is not None and evaluator is not None:
+            raise ValueError("An evaluator trains on its own data, give the input pipeline to the evaluator")
+        if autotuner is not None and evaluator is not None:
+            raise ValueError("The evaluator's workers tune themselves, give the autotuner to the evaluator")
+        if packing is not None and (workers > 0 or evaluator is not None or halving is not None):
+            raise ValueError("Packed candidates train together in this process, for their whole epoch budget")
+        if packing is not None and (inherit_weights or autotuner is not None):
+            raise ValueError("Packed candidates share their batches and epochs, they cannot inherit weights or "
+                             "tune their batch size")
+        if (workers > 0 or evaluator is not None) and halving is not None:
+            raise ValueError("Successive halving resumes models in place and cannot run on parallel workers")
+        if curve_termination and halving is not None:
+            raise ValueError("Successive halving already stops weak candidates, use one or the other")
+        if restore_best and halving is not None:
+            raise ValueError("Successive halving ranks candidates on their last rung, it cannot restore their best "
+                             "epoch")
+        if pareto is not None and halving is not None:
+            raise ValueError("Pareto selection compares final scores, it cannot rank successive halving rungs")
+        if pareto is not None and curve_termination:
+            raise ValueError("Pareto selection may keep cheap low scoring candidates, curves cannot be cut off")
         self.population = []
         self.selected = []
         self.train_x = train_x
@@ -31,53 +118,679 @@ class Breeder:
         self.val_x = val_x
         self.val_y = val_y
         self.input_shape = train_x.shape[1:]
-        self.output_shape = train_y.shape[-1]
+        # Datasets keep their labels as class indices
+        self.output_shape = train_x.classes_nbr if isinstance(train_x, Dataset) else train_y.shape[-1]
+        self.fitness_cache = fitness_cache
+        self.evaluator = evaluator
+        if workers > 0:
+            self.evaluator = ParallelEvaluator(train_x, train_y, val_x, val_y, workers, threads_per_worker, pipeline,
+                                               autotuner)
+        self.seed = seed
+        self.halving = halving
+        self.inherit_weights = inherit_weights
+        self.curve_termination = curve_termination
+        # Trained weights are spilled to disk so that no Keras model outlives its training
+        self.keep_weights = keep_weights or inherit_weights
+        if self.keep_weights and self.evaluator is not None and not self.evaluator.transfers_weights:
+            raise ValueError("This evaluator does not bring trained weights back, they cannot be kept or inherited")
+        if weights_dir is None and checkpoint_path is not None:
+            # Weights must survive the process for a checkpoint to be resumable
+            weights_dir = checkpoint_path + '_weights'
+            os.makedirs(weights_dir, exist_ok=True)
+        # A directory the breeder made up itself is removed when it is closed
+        self.temporary_weights_dir = weights_dir is None
+        self.weights_dir = weights_dir if weights_dir is not None else tempfile.mkdtemp(prefix='darwini')
+        self.checkpoint_path = checkpoint_path
+        self.checkpoint_interval = checkpoint_interval
+        self.generation_state = {}
+        self.round_results = {}
+        self.resumed_results = {}
+        self.surrogate = surrogate
+        self.predictions = {}
+        self.telemetry = telemetry if telemetry is not None else Telemetry()
+        if isinstance(self.evaluator, DistributedEvaluator) and self.evaluator.telemetry is None:
+            # Reassigned tasks show up in the run's events
+            self.evaluator.telemetry = self.telemetry
+        self.generation_failures = []
+        self.pareto = pareto
+        self.latency = latency
+        # Candidates keep the weights of their best validation epoch rather than those of the last one
+        self.restore_best = restore_best
+        # Built once and reused by every training of this process
+        self.pipeline = pipeline
+        # Batch sizes are probed once per architecture class, thread counts once for the worker processes
+        self.autotuner = autotuner
+        # Small candidates are trained several at a time in one fused model
+        self.packing = packing
+        # Offspring counts follow the diversity of the parents, the run stops once improvements stall
+        self.convergence = convergence
+        if seed is not None:
+            random.seed(seed)
+
+    @staticmethod
+    def from_datasets(train: Dataset, val: Dataset, **kwargs) -> 'Breeder':
+        return Breeder(train, None, val, None, **kwargs)
+
+    @staticmethod
+    def resume(checkpoint_path: str, train_x: Union[ndarray, Dataset], train_y: Optional[ndarray],
+               val_x: Union[ndarray, Dataset], val_y: Optional[ndarray], **kwargs) -> 'Breeder':
+        breeder = Breeder(train_x, train_y, val_x, val_y, checkpoint_path=checkpoint_path, **kwargs)
+        breeder.__restore(load_checkpoint(checkpoint_path))
+        breeder.telemetry.emit('resumed', breeder.generation_nbr, results=len(breeder.resumed_results))
+        return breeder
 
     def __initialize(self):
-        for i in range(self.population_size):
-            success = False
-            while not success:
-                network = Network.generate(self.input_shape, self.output_shape)
-                success = self.__compile_and_fit(network, i + 1)
+        self.__breed(lambda _: Network.generate(self.input_shape, self.output_shape), self.population_size)
+        self.__update_surrogate(0)
         self.__select()
+        self.__report()
         return self.population[0]
 
     def generation(self):
+        self.generation_start = time.time()
+        # An interrupted generation restarts from this state, replaying the candidates it already evaluated
+        self.generation_state = self.__state()
+        self.round_results = {}
+        self.generation_failures = []
+        self.generation_evaluated = 0
         if self.generation_nbr == 0:
             self.generation_nbr += 1
             return self.__initialize()
 
         self.generation_nbr += 1
         self.population = self.selected
-        for i, pair in enumerate(permutations(self.selected, 2)):
-            success = False
-            while not success:
-                print("retry")
-                network = pair[0][1].blend(pair[1][1])
-                network.mutate()
-                success = self.__compile_and_fit(network, i + 1)
-            K.clear_session()
+        parents_nbr = len(self.selected)
+        pairs = list(permutations(self.selected, 2))
+        if self.convergence is not None:
+            pairs = self.convergence.pairs(pairs)
+        if self.surrogate is not None and self.surrogate.is_ready():
+            self.__breed(*self.__screen(pairs))
+        else:
+            self.__breed(lambda i: self.__child(pairs[i]), len(pairs), lambda i: list(pairs[i]))
+        self.__update_surrogate(parents_nbr)
         self.__select()
+        self.__report()
+        return self.population[0]
+
+    def steady_state(self, evaluations: int = None, time_budget: float = None,
+                     tournament_size: int = constants.TOURNAMENT_SIZE) -> Candidate:
+        # Children are bred one at a time whenever an evaluation slot frees up and join the population as soon as
+        # they are scored, so no worker waits for the slowest candidate of a generation
+        if evaluations is None and time_budget is None:
+            raise ValueError("Steady state evolution needs an evaluation or a time budget")
+        if self.halving is not None:
+            raise ValueError("Successive halving needs whole generations, it cannot run in steady state")
+        if self.convergence is not None:
+            raise ValueError("Offspring counts are sized per generation, use a time or evaluation budget instead")
+        # Budgets count from this call on, an interrupted run is resumed with what is left of it
+        count, first = evaluations, self.evaluated_nbr
+        evaluations = first + evaluations if evaluations is not None else math.inf
+        deadline = time.time() + time_budget if time_budget is not None else math.inf
+        slots = self.evaluator.workers if self.evaluator is not None else 1
+        # In-progress checkpoints replay whole generations, steady state saves its population instead
+        self.generation_state = {}
+        self.__start_generation()
+        running = {}
+        while True:
+            while time.time() < deadline and len(running) < slots and self.evaluated_nbr + len(running) < evaluations:
+                network, parents = self.__offspring(len(running), tournament_size)
+                index = self.evaluated_nbr + len(running) - first
+                if self.evaluator is None:
+                    # Serial children are evaluated right away, which keeps seeded runs reproducible
+                    self.__arrive(self.__evaluate([network], [parents], [index], count, [str(index)])[0])
+                    continue
+                cached = self.__cached(network, parents, index, count)
+                if cached is not None:
+                    self.__arrive(cached)
+                    continue
+                seed = self.__seed()
+                future = self.evaluator.submit(network, training.evaluation_seed(network, seed)
+                                               if seed is not None else None, parents, self.__weights_path(),
+                                               self.__cutoff([]), self.restore_best)
+                running[future] = (network, index, parents)
+            if not running:
+                break
+            done, _ = wait(list(running), timeout=max(deadline - time.time(), 0) if deadline < math.inf else None,
+                           return_when=FIRST_COMPLETED)
+            if not done:
+                # Out of time: children already training are still waited for, nothing new is bred
+                done, _ = wait(list(running), return_when=FIRST_COMPLETED)
+            for future in done:
+                network, index, parents = running.pop(future)
+                candidate, error = self.evaluator.result(future)
+                self.__record(str(index), network, candidate, error, index, count)
+                if candidate is not None and candidate.terminated:
+                    self.terminated_trainings += 1
+                elif candidate is not None and self.fitness_cache is not None and not parents:
+                    self.fitness_cache.put(network, candidate.score)
+                self.__arrive(candidate)
+        self.__require_population()
+        if self.generation_evaluated > 0:
+            self.__report()
+        else:
+            # The budget ran out right after a report, no evaluation belongs to the generation opened since
+            self.generation_nbr -= 1
+        # Members that were not selected may still be the parents of a later steady state run, they keep their weights
+        self.__select(discard=False)
         return self.population[0]
 
-    def __compile_and_fit(self, network, generation) -> bool:
+    def converged(self) -> bool:
+        return self.convergence is not None and self.convergence.converged()
+
+    def champion(self) -> Candidate:
+        # Best candidate whose trained weights were kept, ready to be evaluated or exported without retraining
+        for candidate in self.population:
+            if candidate.model is not None or candidate.weights_path is not None:
+                return candidate
+        raise ValueError("No trained weights were kept, create the breeder with keep_weights=True")
+
+    def __start_generation(self) -> None:
+        self.generation_nbr += 1
+        self.generation_start = time.time()
+        self.generation_failures = []
+        self.generation_evaluated = 0
+        self.round_results = {}
+
+    def __offspring(self, running_nbr: int, tournament_size: int) -> Tuple[Network, Optional[List[Candidate]]]:
+        # Random genomes until the population is full, then two tournament winners are blended
+        if len(self.population) + running_nbr < self.population_size:
+            return self.__sample(lambda _: Network.generate(self.input_shape, self.output_shape), 0), None
+        pair = (self.__tournament(tournament_size), self.__tournament(tournament_size))
+        return self.__sample(lambda _: self.__child(pair), 0), self.__parents(list(pair))
+
+    def __tournament(self, size: int) -> Candidate:
+        contestants = random.sample(self.population, min(size, len(self.population)))
+        if self.pareto is not None:
+            return self.pareto.select(contestants, 1)[0]
+        return max(contestants, key=lambda candidate: candidate.score if math.isfinite(candidate.score) else -math.inf)
+
+    def __arrive(self, candidate: Optional[Candidate]) -> None:
+        self.evaluated_nbr += 1
+        if candidate is None:
+            self.failed_trainings += 1
+        else:
+            # Kept in the order __select sorts in, so that the best candidate is always first
+            self.population.append(candidate)
+            self.population.sort(key=lambda member: (member.rung, member.score if math.isfinite(member.score)
+                                                     else -math.inf), reverse=True)
+            if self.pareto is not None:
+                self.pareto.update([candidate])
+            if len(self.population) > self.population_size:
+                self.__replace_worst()
+        if self.checkpoint_path is not None and self.evaluated_nbr % self.checkpoint_interval == 0:
+            save_checkpoint(self.checkpoint_path, self.__state())
+        if self.evaluated_nbr % self.population_size == 0:
+            # Every population size worth of evaluations is reported like a generation
+            self.__require_population()
+            self.__report()
+            self.__start_generation()
+
+    def __require_population(self) -> None:
+        # Children are only bred from trained candidates, a population that never filled up points to a systematic
+        # failure such as a broken backend
+        if not self.population:
+            raise RuntimeError("All {} candidates failed to train, last error: {}".format(
+                self.evaluated_nbr, self.generation_failures[-1] if self.generation_failures else None))
+
+    def __replace_worst(self) -> None:
+        if self.pareto is not None:
+            worst = self.pareto.select(self.population, len(self.population))[-1]
+        else:
+            worst = min(self.population, key=lambda candidate: candidate.score
+                        if math.isfinite(candidate.score) else -math.inf)
+        self.population.remove(worst)
+        # A previous generation may have selected it, a checkpoint only stores selected members of the population
+        if worst in self.selected:
+            self.selected.remove(worst)
+        if self.pareto is None or worst not in self.pareto.front:
+            worst.discard()
+
+    def __cached(self, network: Network, parents: Optional[List[Candidate]], index: int, count: Optional[int]) \
+            -> Optional[Candidate]:
+        # The cache holds scores of genomes trained from scratch. Children fine-tuned from their parents' weights
+        # score differently, they are neither looked up nor stored
+        if self.fitness_cache is None or parents:
+            return None
+        score = self.fitness_cache.get(network)
+        if score is None:
+            return None
+        candidate = Candidate(score, network, rung=self.__final_rung())
+        self.__profile(candidate)
+        self.__emit_candidate('cached', network, candidate, index, count)
+        return candidate
+
+    def __seed(self) -> Optional[int]:
+        return self.seed if self.seed is not None or self.fitness_cache is None else self.fitness_cache.seed
+
+    @staticmethod
+    def __child(pair: Tuple[Candidate, Candidate]) -> Network:
+        return pair[0].network.blend(pair[1].network).mutate()
+
+    def __screen(self, pairs: List[Tuple[Candidate, Candidate]]) \
+            -> Tuple[Callable[[int], Network], int, Callable[[int], List[Candidate]]]:
+        # Draws many more children than can be trained and keeps those the surrogate ranks best
+        count = len(pairs)
+        drawn = [i % count for i in range(count * self.surrogate.factor)]
+        networks = [self.__sample(lambda j: self.__child(pairs[j]), j) for j in drawn]
+        predictions = self.surrogate.predict(networks)
+        best = np.argsort(-predictions, kind='stable')[:count]
+        chosen = [(drawn[k], networks[k]) for k in best]
+        self.predictions = {networks[k].genome_hash(): float(predictions[k]) for k in best}
+        self.telemetry.emit('surrogate_screening', self.generation_nbr, kept=count, drawn=len(networks))
+        screened = set()
+
+        def make_network(i: int) -> Network:
+            # A retried child failed to train, a fresh one is bred from the same parents
+            if i in screened:
+                return self.__child(pairs[chosen[i][0]])
+            screened.add(i)
+            return chosen[i][1]
+
+        return make_network, count, lambda i: list(pairs[chosen[i][0]])
+
+    def __update_surrogate(self, previous_nbr: int) -> None:
+        if self.surrogate is None:
+            return
+        # Partial scores from lower rungs or early termination would teach the surrogate wrong values
+        scored = [candidate for candidate in self.population[previous_nbr:]
+                  if candidate.rung == self.__final_rung() and not candidate.terminated]
+        predicted = [(self.predictions[candidate.network.genome_hash()], candidate.score) for candidate in scored
+                     if candidate.network.genome_hash() in self.predictions]
+        if predicted:
+            correlation = rank_correlation([prediction for prediction, _ in predicted],
+                                           [score for _, score in predicted])
+            self.telemetry.emit('surrogate_correlation', self.generation_nbr, correlation=correlation,
+                                models=len(predicted))
+        self.predictions = {}
+        for candidate in scored:
+            self.surrogate.add(candidate.network, candidate.score)
+        self.surrogate.fit()
+
+    def __breed(self, make_network: Callable[[int], Network], count: int,
+                parents_of: Callable[[int], List[Candidate]] = None) -> None:
+        # All candidates of a round are drawn before any training so that serial and parallel runs
+        # consume the random generator identically
+        pending = list(range(count))
+        round_nbr = 0
+        while pending:
+            networks = [self.__sample(make_network, i) for i in pending]
+            parents = [self.__parents(parents_of(i)) if parents_of is not None else None for i in pending]
+            keys = ["{}:{}".format(round_nbr, i) for i in pending]
+            candidates = self.__evaluate(networks, parents, pending, count, keys)
+            failed = []
+            for i, candidate in zip(pending, candidates):
+                if candidate is None:
+                    failed.append(i)
+                    continue
+                self.population.append(candidate)
+            if failed:
+                self.failed_trainings += len(failed)
+                # Only a first round where nothing trains points to a systematic failure, such as a broken backend
+                # on every worker. Later failures are unlucky genomes, retried a few times and then given up on
+                if round_nbr == 0 and len(failed) == len(pending) > 1:
+                    raise RuntimeError("All {} candidates failed to train, last error: {}".format(
+                        len(failed), self.generation_failures[-1] if self.generation_failures else None))
+                if round_nbr >= constants.MAX_TRAINING_RETRIES:
+                    self.telemetry.emit('dropped', self.generation_nbr, failed=len(failed), round=round_nbr,
+                                        indexes=failed)
+                    break
+                self.telemetry.emit('retry', self.generation_nbr, failed=len(failed), round=round_nbr,
+                                    indexes=failed)
+            pending = failed
+            round_nbr += 1
+
+    def __sample(self, make_network: Callable[[int], Network], index: int) -> Network:
+        # Invalid genomes are repaired or resampled here, before Keras ever sees them.
+        # The operators already fit the compute budget, only architectures too large at any width are rejected
+        for _ in range(constants.MAX_GENOME_RESAMPLES):
+            network = make_network(index)
+            if network.is_valid() and network.is_within_budget():
+                return network
+            network = network.repair()
+            if network.is_valid() and network.is_within_budget():
+                self.repaired_genomes += 1
+                return network
+            self.rejected_genomes += 1
+        raise ValueError("No valid network within the compute budget found for input shape {}".format(
+            self.input_shape))
+
+    def __parents(self, candidates: List[Candidate]) -> Optional[List[Candidate]]:
+        if not self.inherit_weights:
+            return None
+        return [candidate for candidate in candidates if candidate.weights_path is not None]
+
+    def __weights_path(self) -> Optional[str]:
+        if not self.keep_weights:
+            return None
+        self.spilled_nbr += 1
+        return os.path.join(self.weights_dir, "weights{}.npz".format(self.spilled_nbr))
+
+    def __evaluate(self, networks: List[Network], parents: List[Optional[List[Candidate]]], indexes: List[int],
+                   count: int, keys: List[str]) -> List[Optional[Candidate]]:
+        candidates = [None] * len(networks)
+        to_train = []
+        restored = []
+        for i, network in enumerate(networks):
+            resumed = self.resumed_results.pop(keys[i], None)
+            if resumed is not None and resumed[0] == network.genome_hash():
+                self.__emit_candidate('restored', network, resumed[1], indexes[i], count)
+                candidates[i] = resumed[1]
+                restored.append(i)
+                self.round_results[keys[i]] = resumed
+                continue
+            candidates[i] = self.__cached(network, parents[i], indexes[i], count)
+            if candidates[i] is None:
+                to_train.append(i)
+
+        seed = self.__seed()
+        seeds = [training.evaluation_seed(networks[i], seed) if seed is not None else None for i in to_train]
+        if self.evaluator is not None:
+            self.telemetry.emit('parallel_training', self.generation_nbr, models=len(to_train),
+                                workers=self.evaluator.workers)
+            cutoff = self.__cutoff([])
+            trained = self.evaluator.evaluate([networks[i] for i in to_train], seeds, [parents[i] for i in to_train],
+                                              [self.__weights_path() for _ in to_train], cutoff=cutoff,
+                                              on_result=lambda j, candidate, error: self.__record(
+                                                  keys[to_train[j]], networks[to_train[j]], candidate, error,
+                                                  indexes[to_train[j]], count, cutoff),
+                                              restore_best=self.restore_best)
+            for i, candidate in zip(to_train, trained):
+                candidates[i] = candidate
+        elif self.halving is not None:
+            trained, errors = self.__successive_halving([networks[i] for i in to_train], seeds,
+                                                        [parents[i] for i in to_train])
+            for i, candidate, error in zip(to_train, trained, errors):
+                candidates[i] = candidate
+                self.__record(keys[i], networks[i], candidate, error, indexes[i], count)
+        elif self.packing is not None:
+            self.__train_packs(networks, to_train, seeds, candidates, indexes, count, keys)
+        else:
+            # Keras is only imported by the process that trains, coordinators of remote workers never load it.
+            # Clearing the session does not give back all of TensorFlow's memory, long runs use workers instead
+            import keras.backend as K
+            for i, seed in zip(to_train, seeds):
+                self.telemetry.emit('training', self.generation_nbr, index=indexes[i] + 1, count=count)
+                cutoff = self.__cutoff([candidate for candidate in candidates if candidate is not None])
+                candidates[i], error = self.__compile_and_fit(networks[i], seed, parents[i], cutoff)
+                if candidates[i] is not None:
+                    candidates[i].spill(self.__weights_path())
+                K.clear_session()
+                self.__record(keys[i], networks[i], candidates[i], error, indexes[i], count, cutoff)
+
+        self.terminated_trainings += len([candidates[i] for i in to_train + restored
+                                          if candidates[i] is not None and candidates[i].terminated])
+        if self.fitness_cache is not None:
+            for i in to_train:
+                # Candidates stopped at a lower rung or terminated early only have a partial score
+                if candidates[i] is not None and candidates[i].rung == self.__final_rung() \
+                        and not candidates[i].terminated and not parents[i]:
+                    self.fitness_cache.put(networks[i], candidates[i].score)
+        return candidates
+
+    def __train_packs(self, networks: List[Network], to_train: List[int], seeds: List[Optional[int]],
+                      candidates: List[Optional[Candidate]], indexes: List[int], count: int, keys: List[str]) -> None:
+        import keras.backend as K
+        from darwini.packing import train_pack
+        # Training consumes the random generator, which would make genome sampling depend on the packing
+        state = random.getstate()
+        for pack in self.packing.packs([networks[i] for i in to_train]):
+            members = [to_train[j] for j in pack]
+            cutoff = self.__cutoff([candidate for candidate in candidates if candidate is not None])
+            self.telemetry.emit('packed_training', self.generation_nbr, models=len(members), count=count,
+                                indexes=[indexes[i] + 1 for i in members])
+            results = train_pack([networks[i] for i in members], self.train_x, self.train_y, self.val_x, self.val_y,
+                                 [seeds[j] for j in pack], cutoff, self.restore_best, self.pipeline)
+            for i, (candidate, error) in zip(members, results):
+                candidates[i] = candidate
+                if candidate is not None:
+                    candidate.spill(self.__weights_path())
+            K.clear_session()
+            for i, (candidate, error) in zip(members, results):
+                self.__record(keys[i], networks[i], candidate, error, indexes[i], count, cutoff)
+        random.setstate(state)
+
+    def __record(self, key: str, network: Network, candidate: Optional[Candidate], error: Optional[str], index: int,
+                 count: Optional[int], cutoff: float = None) -> None:
+        if candidate is None:
+            self.generation_failures.append(error)
+            self.__emit_candidate('failed', network, None, index, count, error=error)
+        else:
+            self.__profile(candidate)
+            self.__autotuned(candidate)
+            self.__emit_candidate('terminated' if candidate.terminated else 'trained', network, candidate, index,
+                                  count, cutoff=cutoff)
+        self.round_results[key] = (network.genome_hash(), candidate)
+        if self.checkpoint_path is not None and self.generation_state \
+                and len(self.round_results) % self.checkpoint_interval == 0:
+            # Counters and the random state are those of the generation start, the weights counter must go on
+            state = dict(self.generation_state, spilled_nbr=self.spilled_nbr,
+                         results=encode_results(self.round_results))
+            save_checkpoint(self.checkpoint_path, state)
+
+    def __profile(self, candidate: Candidate) -> None:
+        if self.latency is None or candidate.latency is not None:
+            return
+        # Building the timed layers consumes the random generator like any Keras model
+        state = random.getstate()
         try:
-            model = network.compile()
-            early_stopper = EarlyStopping(patience=3)
-            print("Generation {} : Training model {}/{}".format(self.generation_nbr, generation, self.population_size))
-            model.fit(self.train_x, self.train_y, batch_size=constants.BATCH_SIZE, epochs=constants.EPOCH_NBR,
-                      verbose=1, validation_data=(self.val_x, self.val_y), callbacks=[early_stopper])
-        except KeyboardInterrupt:
-            raise
-        except:
-            return False
-        score = model.evaluate(self.val_x, self.val_y, verbose=0)
-        self.population.append((score[1], network, model))
-        return True
-
-    def __select(self):
-        self.population.sort(key=lambda item: item[0], reverse=True)
-        self.selected = self.population[:5]
-        self.selected.extend(random.sample(self.population[5:], 5))
+            candidate.latency = self.latency.estimate(candidate.network)
+        finally:
+            random.setstate(state)
+
+    def __autotuned(self, candidate: Candidate) -> None:
+        # Only the training that probed a new architecture class carries the probe results
+        if 'autotune' not in candidate.stats:
+            return
+        key, choice = candidate.stats['architecture_class'], candidate.stats.pop('autotune')
+        if self.autotuner is not None:
+            self.autotuner.record(key, choice)
+        self.telemetry.emit('autotune_class', self.generation_nbr, architecture_class=key, **choice)
+
+    def __emit_candidate(self, status: str, network: Network, candidate: Optional[Candidate], index: int,
+                         count: int, **fields) -> None:
+        self.generation_evaluated += 1
+        if candidate is not None:
+            fields.update(candidate.stats, score=float(candidate.score), rung=candidate.rung,
+                          latency_s=candidate.latency)
+        self.telemetry.emit('candidate', self.generation_nbr, status=status, index=index + 1, count=count,
+                            genome=network.genome_hash(), parameters=network.parameter_count(),
+                            multiply_adds=network.multiply_adds(), **fields)
+
+    def __state(self) -> dict:
+        state = {'generation_nbr': self.generation_nbr, 'random_state': encode_random_state(random.getstate()),
+                 'spilled_nbr': self.spilled_nbr, 'repaired_genomes': self.repaired_genomes,
+                 'rejected_genomes': self.rejected_genomes, 'failed_trainings': self.failed_trainings,
+                 'terminated_trainings': self.terminated_trainings, 'evaluated_nbr': self.evaluated_nbr,
+                 'results': {}}
+        if self.surrogate is not None:
+            state['surrogate'] = self.surrogate.to_dict()
+        if self.autotuner is not None:
+            state['autotuner'] = self.autotuner.to_dict()
+        if self.convergence is not None:
+            state['convergence'] = self.convergence.to_dict()
+        if self.pareto is not None:
+            state['pareto_front'] = [candidate.to_dict() for candidate in self.pareto.front]
+        state.update(encode_population(self.population, self.selected))
+        return state
+
+    def __restore(self, state: dict) -> None:
+        self.generation_nbr = state['generation_nbr']
+        random.setstate(decode_random_state(state['random_state']))
+        self.spilled_nbr = state['spilled_nbr']
+        self.repaired_genomes = state['repaired_genomes']
+        self.rejected_genomes = state['rejected_genomes']
+        self.failed_trainings = state['failed_trainings']
+        self.terminated_trainings = state['terminated_trainings']
+        self.evaluated_nbr = state.get('evaluated_nbr', 0)
+        self.population, self.selected = decode_population(state)
+        self.resumed_results = decode_results(state['results'])
+        if self.surrogate is not None and 'surrogate' in state:
+            self.surrogate.restore(state['surrogate'])
+        if self.autotuner is not None and 'autotuner' in state:
+            self.autotuner.restore(state['autotuner'])
+        if self.convergence is not None and 'convergence' in state:
+            self.convergence.restore(state['convergence'])
+        if self.pareto is not None and 'pareto_front' in state:
+            self.pareto.front = [Candidate.from_dict(candidate) for candidate in state['pareto_front']]
+
+    def __cutoff(self, trained: List[Candidate]) -> Optional[float]:
+        # Score of the weakest candidate that would still be among the best ones kept by __select
+        if not self.curve_termination:
+            return None
+        scores = sorted([candidate.score for candidate in self.population + trained], reverse=True)
+        if len(scores) < self.best_selected_nbr:
+            return None
+        return scores[self.best_selected_nbr - 1]
+
+    def __compile_and_fit(self, network: Network, seed: Optional[int], parents: Optional[List[Candidate]],
+                          cutoff: Optional[float]) -> Tuple[Optional[Candidate], Optional[str]]:
+        # Training consumes the random generator, which would make genome sampling depend on the evaluator
+        state = random.getstate()
+        try:
+            return training.train_candidate(network, self.train_x, self.train_y, self.val_x, self.val_y,
+                                            seed=seed, parents=parents, cutoff=cutoff,
+                                            restore_best=self.restore_best, pipeline=self.pipeline,
+                                            autotuner=self.autotuner), None
+        except Exception as exception:
+            return None, repr(exception)
+        finally:
+            random.setstate(state)
+
+    def __successive_halving(self, networks: List[Network], seeds: List[Optional[int]],
+                             parents: List[Optional[List[Candidate]]]) \
+            -> Tuple[List[Optional[Candidate]], List[Optional[str]]]:
+        import keras.backend as K
+        from darwini.callbacks import EpochTimer
+        state = random.getstate()
+        candidates = [None] * len(networks)
+        errors = [None] * len(networks)
+        timers = [EpochTimer() for _ in networks]
+        compile_times = [0.0] * len(networks)
+        batch_sizes = [None] * len(networks)
+        tunings = [{} for _ in networks]
+        peaks = [{} for _ in networks]
+        alive = []
+        for i, (network, seed, network_parents) in enumerate(zip(networks, seeds, parents)):
+            try:
+                if self.autotuner is not None:
+                    batch_sizes[i], tuning = self.autotuner.batch_size(network)
+                    tunings[i] = training.autotune_stats(network, batch_sizes[i], tuning)
+                start = time.perf_counter()
+                model, _ = training.compile_network(network, seed, network_parents)
+                candidates[i] = Candidate(0, network, model)
+                alive.append(i)
+                compile_times[i] = time.perf_counter() - start
+            except Exception as exception:
+                errors[i] = repr(exception)
+
+        trained_epochs = 0
+        for rung, epochs in enumerate(self.halving.budgets()):
+            for rank, i in enumerate(alive):
+                self.telemetry.emit('rung_training', self.generation_nbr, rung=rung, index=rank + 1,
+                                    count=len(alive), epochs=epochs)
+                try:
+                    reset_peak_rss()
+                    start_rss = rss_mb()
+                    # Resumes training of the same model instead of starting over
+                    candidates[i].score = training.fit(candidates[i].model, self.train_x, self.train_y, self.val_x,
+                                                       self.val_y, epochs, initial_epoch=trained_epochs,
+                                                       callbacks=[timers[i]], pipeline=self.pipeline,
+                                                       batch_size=batch_sizes[i])
+                    candidates[i].rung = rung
+                    stats = training.training_stats(compile_times[i], timers[i], start_rss)
+                    # Every rung resets the high-water mark, a candidate's peak is the highest of its rungs
+                    peaks[i] = {key: max(value, peaks[i].get(key, value)) for key, value in stats.items()
+                                if key.startswith('peak_rss')}
+                    candidates[i].stats = dict(stats, **peaks[i], **tunings[i])
+                except Exception as exception:
+                    candidates[i] = None
+                    errors[i] = repr(exception)
+            alive = [i for i in alive if candidates[i] is not None]
+            alive.sort(key=lambda index: candidates[index].score, reverse=True)
+            # Eliminated candidates release their model right away
+            for i in alive[self.halving.survivors(len(alive)):]:
+                candidates[i].spill(self.__weights_path())
+            alive = alive[:self.halving.survivors(len(alive))]
+            trained_epochs = epochs
+        for i in alive:
+            candidates[i].spill(self.__weights_path())
+        K.clear_session()
+        random.setstate(state)
+        return candidates, errors
+
+    def __final_rung(self) -> int:
+        return len(self.halving.budgets()) - 1 if self.halving is not None else 0
+
+    def close(self) -> None:
+        if self.evaluator is not None:
+            self.evaluator.close()
+        self.telemetry.close()
+        if self.temporary_weights_dir:
+            shutil.rmtree(self.weights_dir, ignore_errors=True)
+
+    def __report(self):
+        scores = [candidate.score for candidate in self.population]
+        attempts = self.generation_evaluated
+        self.telemetry.emit('generation', self.generation_nbr, duration_s=time.time() - self.generation_start,
+                            evaluated=attempts, failed=len(self.generation_failures),
+                            failure_rate=len(self.generation_failures) / attempts if attempts > 0 else 0.0,
+                            failures=self.generation_failures, scores=score_summary(scores),
+                            best_score=float(self.population[0].score), repaired_genomes=self.repaired_genomes,
+                            rejected_genomes=self.rejected_genomes, failed_trainings=self.failed_trainings,
+                            terminated_trainings=self.terminated_trainings)
+        if self.fitness_cache is not None:
+            self.telemetry.emit('fitness_cache', self.generation_nbr, hits=self.fitness_cache.hits,
+                                misses=self.fitness_cache.misses, stored=len(self.fitness_cache))
+        if self.pareto is not None:
+            self.telemetry.emit('pareto_front', self.generation_nbr, size=len(self.pareto.front),
+                                cost=self.pareto.cost_name,
+                                front=[(float(candidate.score), self.pareto.cost_of(candidate.network))
+                                       for candidate in self.pareto.front])
+        if self.latency is not None:
+            self.telemetry.emit('latency_table', self.generation_nbr, hits=self.latency.hits,
+                                misses=self.latency.misses, stored=len(self.latency))
+        if self.surrogate is not None:
+            self.telemetry.emit('surrogate', self.generation_nbr, samples=len(self.surrogate),
+                                factor=self.surrogate.factor, ready=self.surrogate.is_ready())
+        if self.autotuner is not None:
+            self.telemetry.emit('autotune', self.generation_nbr, classes=len(self.autotuner),
+                                threads=self.autotuner.threads, thread_rates=self.autotuner.thread_rates,
+                                batch_sizes={key: choice['batch_size'] for key, choice in
+                                             self.autotuner.choices.items()})
+        if self.convergence is not None:
+            self.telemetry.emit('convergence', self.generation_nbr, offspring=self.convergence.offspring_count(),
+                                stalled=self.convergence.stalled, converged=self.convergence.converged(),
+                                **self.convergence.history[-1])
+
+    def __observe_convergence(self) -> None:
+        # Compute is counted in worker hours, every evaluation slot is busy for the whole generation
+        slots = self.evaluator.workers if self.evaluator is not None else 1
+        finite = [candidate.score for candidate in self.population if math.isfinite(candidate.score)]
+        best = float(max(finite)) if finite else 0.
+        median = float(np.median(finite)) if finite else 0.
+        self.convergence.observe(best, median, (time.time() - self.generation_start) * slots / 3600,
+                                 diversity([candidate.network for candidate in self.selected]))
+
+    def __select(self, discard: bool = True):
+        # Candidates that reached a higher rung were trained longer, their scores are not comparable
+        self.population.sort(key=lambda candidate: (candidate.rung, candidate.score), reverse=True)
+        if self.pareto is not None:
+            # Ranked on score and cost together, the population itself stays sorted by score
+            self.selected = self.pareto.select(self.population, self.best_selected_nbr)
+            self.pareto.update(self.population)
+        else:
+            self.selected = self.population[:self.best_selected_nbr]
+        others = [candidate for candidate in self.population if candidate not in self.selected]
+        self.selected.extend(random.sample(others, min(5, len(others))))
         for i, select in enumerate(self.selected):
-            select[1].save("gen{}elem{}".format(self.generation_nbr, i))
+            select.network.save("gen{}elem{}".format(self.generation_nbr, i))
+        # Weights of the Pareto front are kept so that any model on it can be picked later
+        front = {candidate.network.genome_hash() for candidate in self.pareto.front} if self.pareto else set()
+        for candidate in self.population if discard else []:
+            if candidate not in self.selected and candidate.network.genome_hash() not in front:
+                candidate.discard()
+        if self.convergence is not None:
+            # Observed before the checkpoint so that a resumed run knows whether it had converged
+            self.__observe_convergence()
+        if self.checkpoint_path is not None:
+            save_checkpoint(self.checkpoint_path, self.__state())
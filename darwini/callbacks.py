@@ -0,0 +1,91 @@
+import math
+import time
+from typing import List
+
+import numpy as np
+from keras.callbacks import Callback
+
+from darwini import constants
+
+
+class CurveTermination(Callback):
+    cutoff: float
+    max_epochs: int
+    min_epochs: int
+    margin: float
+    accuracies: List[float]
+    terminated: bool
+
+    def __init__(self, cutoff: float, max_epochs: int, min_epochs: int = constants.CURVE_MIN_EPOCHS,
+                 margin: float = constants.CURVE_MARGIN) -> None:
+        super().__init__()
+        self.cutoff = cutoff
+        self.max_epochs = max_epochs
+        self.min_epochs = min_epochs
+        self.margin = margin
+        self.accuracies = []
+        self.terminated = False
+
+    def on_epoch_end(self, epoch, logs=None):
+        logs = logs or {}
+        accuracy = logs.get('val_accuracy', logs.get('val_acc'))
+        if accuracy is not None and self.observe(epoch, accuracy):
+            self.model.stop_training = True
+
+    def observe(self, epoch: int, accuracy: float) -> bool:
+        self.accuracies.append(accuracy)
+        if len(self.accuracies) < self.min_epochs or epoch + 1 >= self.max_epochs:
+            return False
+        if self.projected_accuracy() + self.margin < self.cutoff:
+            self.terminated = True
+        return self.terminated
+
+    def projected_accuracy(self) -> float:
+        # Fits acc = a + b * log(epoch), which keeps growing and therefore overestimates a saturating curve,
+        # then adds twice the residual deviation so that only clearly hopeless candidates are stopped
+        epochs = np.log(np.arange(1, len(self.accuracies) + 1))
+        accuracies = np.array(self.accuracies)
+        slope, intercept = np.polyfit(epochs, accuracies, 1)
+        residuals = accuracies - (intercept + slope * epochs)
+        projected = intercept + max(slope, 0) * math.log(self.max_epochs) + 2 * residuals.std()
+        return min(max(projected, accuracies.max()), 1.0)
+
+
+class EpochTimer(Callback):
+    durations: List[float]
+    start: float
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.durations = []
+        self.start = 0
+
+    def on_epoch_begin(self, epoch, logs=None):
+        self.start = time.perf_counter()
+
+    def on_epoch_end(self, epoch, logs=None):
+        self.durations.append(time.perf_counter() - self.start)
+
+
+class BestEpoch(Callback):
+    best_accuracy: float
+    best_epoch: int
+
+    def __init__(self) -> None:
+        super().__init__()
+        self.best_accuracy = -math.inf
+        self.best_epoch = -1
+        self.best_weights = None
+
+    def on_epoch_end(self, epoch, logs=None):
+        logs = logs or {}
+        accuracy = logs.get('val_accuracy', logs.get('val_acc'))
+        if accuracy is not None and accuracy > self.best_accuracy:
+            self.best_accuracy = accuracy
+            self.best_epoch = epoch
+            self.best_weights = self.model.get_weights()
+
+    def on_train_end(self, logs=None):
+        # Early stopping waits a few epochs past the best one, whose weights are put back here
+        if self.best_weights is not None:
+            self.model.set_weights(self.best_weights)
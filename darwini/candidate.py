@@ -0,0 +1,99 @@
+import os
+from typing import TYPE_CHECKING, Optional, Union
+
+from numpy.core.records import ndarray
+
+from darwini import constants
+from darwini.individuals.network import Network
+from darwini.inheritance import WeightSnapshot, load_snapshot, save_snapshot, weight_snapshot
+
+if TYPE_CHECKING:
+    from keras import Sequential
+
+    from darwini.dataset import Dataset
+
+
+class Candidate:
+    score: float
+    network: Network
+    model: Optional['Sequential']
+    rung: int
+    weights_path: Optional[str]
+    terminated: bool
+    latency: Optional[float]
+    stats: dict
+
+    def __init__(self, score: float, network: Network, model: 'Sequential' = None, rung: int = 0,
+                 weights_path: str = None, terminated: bool = False, latency: float = None) -> None:
+        self.score = score
+        self.network = network
+        self.model = model
+        self.rung = rung
+        self.weights_path = weights_path
+        self.terminated = terminated
+        # Estimated inference latency in seconds
+        self.latency = latency
+        # Training measurements reported through telemetry
+        self.stats = {}
+
+    def to_dict(self) -> dict:
+        return {'score': float(self.score), 'network': self.network.to_dict(), 'rung': self.rung,
+                'weights_path': self.weights_path, 'terminated': self.terminated, 'latency': self.latency}
+
+    @staticmethod
+    def from_dict(data: dict) -> 'Candidate':
+        return Candidate(data['score'], Network.from_dict(data['network']), rung=data['rung'],
+                         weights_path=data['weights_path'], terminated=data['terminated'], latency=data.get('latency'))
+
+    def spill(self, weights_path: Optional[str]) -> None:
+        # Only the genome, the score and a handle to the weights on disk outlive the training
+        if self.model is not None and weights_path is not None:
+            save_snapshot(weight_snapshot(self.model), weights_path)
+            self.weights_path = weights_path
+        self.model = None
+
+    def trained_weights(self) -> Optional[WeightSnapshot]:
+        if self.model is not None:
+            return weight_snapshot(self.model)
+        if self.weights_path is not None:
+            return load_snapshot(self.weights_path)
+        return None
+
+    def load_model(self) -> 'Sequential':
+        if self.model is not None:
+            return self.model
+        weights = self.trained_weights()
+        if weights is None:
+            raise ValueError("No trained weights kept for this candidate")
+        model = self.network.compile()
+        for layer, layer_weights in zip([layer for layer in model.layers if len(layer.weights) > 0], weights):
+            layer.set_weights(layer_weights)
+        return model
+
+    def evaluate(self, x: Union[ndarray, 'Dataset'], y: Optional[ndarray] = None) -> float:
+        # Candidates are also handled by processes that never train, Keras comes with the datasets
+        from darwini.dataset import Dataset
+        # Scores the trained weights as they are, nothing is trained again
+        model = self.load_model()
+        if isinstance(x, Dataset):
+            return model.evaluate(x.sequence(constants.BATCH_SIZE), verbose=0)[1]
+        return model.evaluate(x, y, batch_size=constants.BATCH_SIZE, verbose=0)[1]
+
+    def export(self, path: str) -> None:
+        # Keras picks the format from the extension: .keras, .h5 or a SavedModel directory, the genome goes alongside
+        self.load_model().save(path)
+        self.network.save(path + '.json')
+
+    def discard(self) -> None:
+        if self.weights_path is not None and os.path.exists(self.weights_path):
+            os.remove(self.weights_path)
+        self.weights_path = None
+        self.model = None
+
+    def __str__(self) -> str:
+        string = "Candidate score:{}\trung:{}".format(self.score, self.rung)
+        if self.latency is not None:
+            string += "\tlatency:{:.2f}ms".format(self.latency * 1000)
+        if self.terminated:
+            string += "\tterminated"
+        return string + "\n" + str(self.network)
@@ -0,0 +1,55 @@
+import json
+import os
+from typing import Dict, List, Optional, Tuple
+
+from darwini.candidate import Candidate
+
+CHECKPOINT_VERSION = 1
+
+
+def encode_random_state(state: tuple) -> list:
+    version, internal_state, gauss_next = state
+    return [version, list(internal_state), gauss_next]
+
+
+def decode_random_state(state: list) -> tuple:
+    version, internal_state, gauss_next = state
+    return version, tuple(internal_state), gauss_next
+
+
+def encode_results(results: Dict[str, Tuple[str, Optional[Candidate]]]) -> dict:
+    return {key: {'genome': genome, 'candidate': candidate.to_dict() if candidate is not None else None}
+            for key, (genome, candidate) in results.items()}
+
+
+def decode_results(results: dict) -> Dict[str, Tuple[str, Optional[Candidate]]]:
+    return {key: (result['genome'], Candidate.from_dict(result['candidate']) if result['candidate'] else None)
+            for key, result in results.items()}
+
+
+def encode_population(population: List[Candidate], selected: List[Candidate]) -> dict:
+    # Selected candidates are stored as indexes so that they stay the same objects once reloaded
+    return {'population': [candidate.to_dict() for candidate in population],
+            'selected': [population.index(candidate) for candidate in selected]}
+
+
+def decode_population(data: dict) -> Tuple[List[Candidate], List[Candidate]]:
+    population = [Candidate.from_dict(candidate) for candidate in data['population']]
+    return population, [population[i] for i in data['selected']]
+
+
+def save_checkpoint(path: str, state: dict) -> None:
+    # Written next to the previous checkpoint then swapped, a crash while saving leaves the old one intact
+    state = dict(state, version=CHECKPOINT_VERSION)
+    temporary_path = path + '.tmp'
+    with open(temporary_path, 'w') as file:
+        json.dump(state, file)
+    os.replace(temporary_path, path)
+
+
+def load_checkpoint(path: str) -> dict:
+    with open(path) as file:
+        state = json.load(file)
+    if state.get('version') != CHECKPOINT_VERSION:
+        raise ValueError("Unsupported checkpoint version {} in {}".format(state.get('version'), path))
+    return state
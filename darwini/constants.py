@@ -15,3 +15,48 @@ ACTIVATIONS = ['relu']
 MUTATION_RATE = 0.2
 BATCH_SIZE = 128
 EPOCH_NBR = 25
+MAX_GENOME_RESAMPLES = 1000
+MAX_TRAINING_RETRIES = 5
+HALVING_MIN_EPOCHS = 1
+HALVING_REDUCTION_FACTOR = 3
+INHERITED_EPOCH_NBR = 8
+CURVE_MIN_EPOCHS = 3
+CURVE_MARGIN = 0.02
+CHECKPOINT_INTERVAL = 5
+SURROGATE_FACTOR = 5
+SURROGATE_ALPHA = 1.0
+SURROGATE_MIN_SAMPLES = 20
+SURROGATE_CONV_SLOTS = 8
+SURROGATE_DENSE_SLOTS = 10
+GENOME_DENSE_SLOTS = 16
+LATENCY_BATCH_SIZE = 1
+LATENCY_REPEATS = 20
+LATENCY_WARMUP = 3
+TOURNAMENT_SIZE = 3
+WORK_QUEUE_HOST = '127.0.0.1'
+WORK_QUEUE_PORT = 50007
+WORK_QUEUE_POLL = 0.5
+WORKER_HEARTBEAT = 10
+WORKER_TIMEOUT = 60
+WORKER_MAX_TASKS = 10
+MAX_NETWORK_PARAMETERS = 1000000
+MAX_NETWORK_MULTIPLY_ADDS = 50000000
+MAX_NETWORK_ACTIVATIONS = 200000
+BUDGET_SHRINK_FACTOR = 0.9
+PIPELINE_SHUFFLE_BUFFER = 10000
+PIPELINE_READ_CHUNK = 1024
+AUTOTUNE_BATCH_SIZES = [16, 32, 64, 128, 256, 512]
+AUTOTUNE_MIN_BATCH_SIZE = 32
+AUTOTUNE_MAX_BATCH_SIZE = 256
+AUTOTUNE_PROBE_STEPS = 5
+AUTOTUNE_WARMUP_STEPS = 2
+PACK_SIZE = 8
+PACK_MAX_MULTIPLY_ADDS = 2000000
+EARLY_STOPPING_PATIENCE = 3
+MIN_OFFSPRING = 30
+MAX_OFFSPRING = 150
+DIVERSITY_LOW = 1.0
+DIVERSITY_HIGH = 4.0
+MIN_IMPROVEMENT_PER_HOUR = 0.002
+CONVERGENCE_PATIENCE = 2
+MAX_GENERATIONS = 20
@@ -0,0 +1,93 @@
+import math
+import random
+from itertools import combinations
+from typing import List, Optional, TypeVar
+
+from darwini import constants
+from darwini.individuals.network import Network
+
+Pair = TypeVar('Pair')
+
+
+def diversity(networks: List[Network]) -> float:
+    # Mean genome distance over every pair of networks
+    distances = [first.distance(second) for first, second in combinations(networks, 2)]
+    return sum(distances) / len(distances) if distances else 0.
+
+
+class Convergence:
+    min_offspring: int
+    max_offspring: int
+    diversity_low: float
+    diversity_high: float
+    min_improvement: float
+    patience: int
+    max_generations: Optional[int]
+    history: List[dict]
+    stalled: int
+
+    def __init__(self, min_offspring: int = constants.MIN_OFFSPRING, max_offspring: int = constants.MAX_OFFSPRING,
+                 diversity_low: float = constants.DIVERSITY_LOW, diversity_high: float = constants.DIVERSITY_HIGH,
+                 min_improvement: float = constants.MIN_IMPROVEMENT_PER_HOUR,
+                 patience: int = constants.CONVERGENCE_PATIENCE,
+                 max_generations: Optional[int] = constants.MAX_GENERATIONS) -> None:
+        if min_offspring < 1 or max_offspring < min_offspring:
+            raise ValueError("Adaptive sizing needs 1 <= min_offspring <= max_offspring")
+        if diversity_high <= diversity_low:
+            raise ValueError("The high diversity bound must be above the low one")
+        if patience < 1:
+            raise ValueError("Convergence needs a patience of at least one generation")
+        if max_generations is not None and max_generations < 1:
+            raise ValueError("A run needs at least one generation")
+        self.min_offspring = min_offspring
+        self.max_offspring = max_offspring
+        self.diversity_low = diversity_low
+        self.diversity_high = diversity_high
+        self.min_improvement = min_improvement
+        self.patience = patience
+        # Noisy scores may never stall for long enough, the run still ends after this many generations
+        self.max_generations = max_generations
+        self.history = []
+        self.stalled = 0
+
+    def offspring_count(self) -> int:
+        # A varied population is worth exploring with many children, a uniform one only needs a few
+        if not self.history:
+            return self.max_offspring
+        spread = (self.history[-1]['diversity'] - self.diversity_low) / (self.diversity_high - self.diversity_low)
+        spread = min(max(spread, 0.), 1.)
+        return round(self.min_offspring + spread * (self.max_offspring - self.min_offspring))
+
+    def pairs(self, pairs: List[Pair]) -> List[Pair]:
+        # Parent pairs are drawn in random order so that fewer children than pairs do not favour the first parents
+        count = self.offspring_count()
+        shuffled = random.sample(pairs, len(pairs))
+        return [shuffled[i % len(shuffled)] for i in range(count)]
+
+    def observe(self, best: float, median: float, hours: float, diversity: float) -> None:
+        # The run goes on as long as either the best candidate or the bulk of the population improves fast enough
+        record = {'best': best, 'median': median, 'hours': hours, 'diversity': diversity,
+                  'improvement_per_hour': None}
+        if self.history:
+            previous = self.history[-1]
+            improvement = max(best - previous['best'], median - previous['median'], 0.)
+            record['improvement_per_hour'] = improvement / hours if hours > 0 else math.inf
+            self.stalled = self.stalled + 1 if record['improvement_per_hour'] < self.min_improvement else 0
+        self.history.append(record)
+
+    def converged(self) -> bool:
+        return self.stalled >= self.patience or self.max_generations is not None and \
+            len(self.history) >= self.max_generations
+
+    def to_dict(self) -> dict:
+        return {'history': self.history, 'stalled': self.stalled}
+
+    def restore(self, data: dict) -> None:
+        self.history = data['history']
+        self.stalled = data['stalled']
+
+    def __str__(self) -> str:
+        return "Convergence offspring:{}-{}\tdiversity:{}-{}\tmin improvement per hour:{}\tpatience:{}\t" \
+               "max generations:{}".format(self.min_offspring, self.max_offspring, self.diversity_low,
+                                           self.diversity_high, self.min_improvement, self.patience,
+                                           self.max_generations)
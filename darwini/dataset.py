@@ -0,0 +1,79 @@
+from typing import TYPE_CHECKING, Tuple
+
+import numpy as np
+from numpy.core.records import ndarray
+
+if TYPE_CHECKING:
+    from darwini.sequence import DatasetSequence
+
+
+class Dataset:
+    path: str
+    start: int
+    stop: int
+    classes_nbr: int
+    scale: float
+
+    def __init__(self, path: str, classes_nbr: int, start: int = 0, stop: int = None, scale: float = 255.) -> None:
+        # Inputs stay uint8 in a memory-mapped file shared by every process, labels are class indices
+        self.path = path
+        self.classes_nbr = classes_nbr
+        self.scale = scale
+        self.__open()
+        self.start = start
+        self.stop = len(self.x) if stop is None else stop
+
+    @staticmethod
+    def create(path: str, x: ndarray, y: ndarray, classes_nbr: int = None, scale: float = 255.) -> 'Dataset':
+        if x.dtype != np.uint8:
+            raise ValueError("Dataset inputs must be stored as uint8, got {}".format(x.dtype))
+        labels = np.argmax(y, axis=-1) if y.ndim > 1 and y.shape[-1] > 1 else y.reshape(-1)
+        if classes_nbr is None:
+            classes_nbr = int(labels.max()) + 1
+        inputs = np.lib.format.open_memmap(path + '.x.npy', mode='w+', dtype=np.uint8, shape=x.shape)
+        inputs[:] = x
+        inputs.flush()
+        del inputs
+        np.save(path + '.y.npy', labels.astype(np.int32))
+        return Dataset(path, classes_nbr, scale=scale)
+
+    def __open(self) -> None:
+        self.x = np.load(self.path + '.x.npy', mmap_mode='r')
+        self.y = np.load(self.path + '.y.npy', mmap_mode='r')
+
+    def split(self, start: int, stop: int = None) -> 'Dataset':
+        stop = len(self) if stop is None else stop
+        return Dataset(self.path, self.classes_nbr, self.start + start, self.start + stop, self.scale)
+
+    def batch(self, indexes: ndarray) -> Tuple[ndarray, ndarray]:
+        # Normalisation and one-hot encoding only ever happen one batch at a time
+        indexes = np.sort(indexes) + self.start
+        x = self.x[indexes].astype(np.float32) / self.scale
+        y = np.eye(self.classes_nbr, dtype=np.float32)[self.y[indexes]]
+        return x, y
+
+    def sequence(self, batch_size: int, shuffle: bool = False) -> 'DatasetSequence':
+        # Keras sequences are only needed to train, reading and splitting datasets does not import Keras
+        from darwini.sequence import DatasetSequence
+        return DatasetSequence(self, batch_size, shuffle)
+
+    @property
+    def shape(self) -> Tuple[int, ...]:
+        return (len(self),) + self.x.shape[1:]
+
+    def __len__(self) -> int:
+        return self.stop - self.start
+
+    def __getstate__(self) -> dict:
+        # Only the path crosses process boundaries, every worker maps the same pages
+        state = dict(self.__dict__)
+        del state['x'], state['y']
+        return state
+
+    def __setstate__(self, state: dict) -> None:
+        self.__dict__.update(state)
+        self.__open()
+
+    def __str__(self) -> str:
+        return "Dataset {}\tsamples:{}\tshape:{}\tclasses:{}".format(self.path, len(self), self.shape[1:],
+                                                                     self.classes_nbr)
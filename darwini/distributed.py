@@ -0,0 +1,296 @@
+import argparse
+import collections
+import json
+import secrets
+import socket
+import threading
+import time
+import uuid
+from concurrent.futures import Future, as_completed
+from multiprocessing.managers import BaseManager
+from typing import Callable, Dict, List, Optional, Tuple
+
+from darwini import constants
+from darwini.autotune import Autotuner
+from darwini.candidate import Candidate
+from darwini.dataset import Dataset
+from darwini.individuals.network import Network
+from darwini.pipeline import InputPipeline
+from darwini.telemetry import Telemetry
+
+STOP = 'stop'
+
+
+class WorkQueue:
+    # Lives in the coordinator, every worker connection calls it from its own server thread
+    timeout: float
+
+    def __init__(self, timeout: float) -> None:
+        self.timeout = timeout
+        self.lock = threading.Lock()
+        self.pending = collections.deque()
+        self.assigned = {}
+        self.results = {}
+        self.done = set()
+        self.closed = False
+
+    def put(self, task_id: str, task: dict) -> None:
+        with self.lock:
+            self.pending.append((task_id, task))
+
+    def take(self, worker: str) -> Optional[Tuple[str, dict]]:
+        with self.lock:
+            if self.closed:
+                return STOP, {}
+            if not self.pending:
+                return None
+            task_id, task = self.pending.popleft()
+            self.assigned[task_id] = (task, worker, time.time())
+            return task_id, task
+
+    def heartbeat(self, worker: str, task_id: str) -> bool:
+        with self.lock:
+            if task_id not in self.assigned or self.assigned[task_id][1] != worker:
+                return False
+            task, _, _ = self.assigned[task_id]
+            self.assigned[task_id] = (task, worker, time.time())
+            return True
+
+    def complete(self, worker: str, task_id: str, result: dict) -> None:
+        with self.lock:
+            # A task reassigned after a missed heartbeat may come back twice, the first result wins
+            if task_id in self.done:
+                return
+            self.done.add(task_id)
+            self.assigned.pop(task_id, None)
+            self.pending = collections.deque(item for item in self.pending if item[0] != task_id)
+            self.results[task_id] = dict(result, worker=worker)
+
+    def requeue_lost(self) -> List[Tuple[str, str]]:
+        # Task and worker of every assignment whose heartbeats stopped
+        with self.lock:
+            now = time.time()
+            lost = [(task_id, worker) for task_id, (_, worker, beat) in self.assigned.items()
+                    if now - beat > self.timeout]
+            for task_id, _ in lost:
+                task, _, _ = self.assigned.pop(task_id)
+                self.pending.appendleft((task_id, task))
+            return lost
+
+    def pop_results(self) -> Dict[str, dict]:
+        with self.lock:
+            results, self.results = self.results, {}
+            return results
+
+    def close(self) -> None:
+        with self.lock:
+            self.closed = True
+
+    def size(self) -> Tuple[int, int]:
+        with self.lock:
+            return len(self.pending), len(self.assigned)
+
+
+class QueueManager(BaseManager):
+    pass
+
+
+QueueManager.register('queue')
+
+
+class DistributedEvaluator:
+    # Same interface as ParallelEvaluator, the candidates are trained by worker processes on any host
+    workers: int
+    address: Tuple[str, int]
+    authkey: bytes
+    telemetry: Optional[Telemetry]
+    transfers_weights: bool = False
+
+    def __init__(self, address: Tuple[str, int] = (constants.WORK_QUEUE_HOST, constants.WORK_QUEUE_PORT),
+                 authkey: bytes = None, workers: int = 1,
+                 timeout: float = constants.WORKER_TIMEOUT, poll_interval: float = constants.WORK_QUEUE_POLL,
+                 pipeline: InputPipeline = None, autotuner: Autotuner = None, telemetry: Telemetry = None) -> None:
+        # workers is the number of evaluations kept in flight, at least the number of worker processes expected
+        self.workers = workers
+        # The pipeline spec travels with every task, workers build it once next to their own copy of the data
+        self.pipeline = pipeline
+        # Hosts differ, so every worker tunes batch sizes for its own hardware with the same settings
+        self.autotuner = autotuner
+        # A breeder given this evaluator shares its telemetry when none is set here
+        self.telemetry = telemetry
+        self.poll_interval = poll_interval
+        self.queue = WorkQueue(timeout)
+
+        class CoordinatorManager(BaseManager):
+            pass
+
+        CoordinatorManager.register('queue', callable=lambda: self.queue)
+        # Connections to the queue carry pickles, only workers that know the key may run them. Without a key, a
+        # random one is made up and printed for the workers to be started with
+        generated = authkey is None
+        self.authkey = secrets.token_hex(16).encode() if generated else authkey
+        self.server = CoordinatorManager(address, self.authkey).get_server()
+        self.address = self.server.address
+        if generated:
+            print("Work queue listening on {}:{}, start workers with --authkey {}".format(
+                self.address[0], self.address[1], self.authkey.decode()))
+        self.futures = {}
+        self.lock = threading.Lock()
+        self.running = True
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+        self.collector = threading.Thread(target=self.__collect, daemon=True)
+        self.collector.start()
+
+    def __collect(self) -> None:
+        while self.running:
+            for task_id, worker in self.queue.requeue_lost():
+                telemetry = self.telemetry if self.telemetry is not None else Telemetry()
+                telemetry.emit('worker_lost', task=task_id, worker=worker, timeout_s=self.queue.timeout)
+            for task_id, result in self.queue.pop_results().items():
+                with self.lock:
+                    future, network = self.futures.pop(task_id)
+                if result.get('error') is not None:
+                    future.set_result((None, "{} on worker {}".format(result['error'], result['worker'])))
+                    continue
+                candidate = Candidate(result['score'], network, terminated=result['terminated'])
+                candidate.stats = result['stats']
+                future.set_result((candidate, None))
+            time.sleep(self.poll_interval)
+
+    def submit(self, network: Network, seed: Optional[int], parents: Optional[List[Candidate]],
+               weights_path: Optional[str], cutoff: Optional[float], restore_best: bool = False) -> Future:
+        if parents or weights_path is not None:
+            raise ValueError("Trained weights stay on the worker hosts, they can be neither inherited nor kept")
+        task_id = uuid.uuid4().hex
+        future = Future()
+        with self.lock:
+            self.futures[task_id] = (future, network)
+        self.queue.put(task_id, {'network': network.to_dict(), 'seed': seed, 'cutoff': cutoff,
+                                 'restore_best': restore_best,
+                                 'pipeline': self.pipeline.to_dict() if self.pipeline is not None else None,
+                                 'autotuner': self.autotuner.settings() if self.autotuner is not None else None})
+        return future
+
+    def result(self, future: Future) -> Tuple[Optional[Candidate], Optional[str]]:
+        return future.result()
+
+    def evaluate(self, networks: List[Network], seeds: List[Optional[int]],
+                 parents: List[Optional[List[Candidate]]] = None, weights_paths: List[Optional[str]] = None,
+                 cutoff: float = None, on_result: Callable[[int, Optional[Candidate], Optional[str]], None] = None,
+                 restore_best: bool = False) -> List[Optional[Candidate]]:
+        parents = parents if parents is not None else [None] * len(networks)
+        weights_paths = weights_paths if weights_paths is not None else [None] * len(networks)
+        futures = {self.submit(network, seed, network_parents, weights_path, cutoff, restore_best): i for
+                   i, (network, seed, network_parents, weights_path)
+                   in enumerate(zip(networks, seeds, parents, weights_paths))}
+        results = [None] * len(networks)
+        for future in as_completed(futures):
+            results[futures[future]], error = future.result()
+            if on_result is not None:
+                on_result(futures[future], results[futures[future]], error)
+        return results
+
+    def close(self) -> None:
+        # Idle workers are told to stop the next time they ask for work
+        self.queue.close()
+        self.running = False
+        self.collector.join()
+        time.sleep(constants.WORK_QUEUE_POLL * 2)
+        self.server.stop_event.set()
+        self.server.listener.close()
+
+    def __str__(self) -> str:
+        pending, assigned = self.queue.size()
+        return "Work queue {}:{}\tpending:{}\ttraining:{}".format(self.address[0], self.address[1], pending,
+                                                                   assigned)
+
+
+def connect(address: Tuple[str, int], authkey: bytes):
+    manager = QueueManager(address, authkey)
+    manager.connect()
+    return manager.queue()
+
+
+def heartbeat(address: Tuple[str, int], authkey: bytes, worker: str, task_id: str, stop: threading.Event) -> None:
+    # Proxies are not thread safe, heartbeats go through their own connection
+    queue = connect(address, authkey)
+    while not stop.wait(constants.WORKER_HEARTBEAT):
+        queue.heartbeat(worker, task_id)
+
+
+def run_worker(address: Tuple[str, int], authkey: bytes, train: Dataset, val: Dataset, worker: str = None,
+               poll_interval: float = constants.WORK_QUEUE_POLL) -> int:
+    import keras.backend as K
+    from darwini import training
+    worker = worker if worker is not None else "{}-{}".format(socket.gethostname(), uuid.uuid4().hex[:6])
+    queue = connect(address, authkey)
+    pipelines = {}
+    autotuners = {}
+    evaluated = 0
+    while True:
+        try:
+            task = queue.take(worker)
+        except (ConnectionError, EOFError):
+            # The coordinator is gone
+            break
+        if task is None:
+            time.sleep(poll_interval)
+            continue
+        task_id, task = task
+        if task_id == STOP:
+            break
+        stop = threading.Event()
+        threading.Thread(target=heartbeat, args=(address, authkey, worker, task_id, stop), daemon=True).start()
+        try:
+            pipeline = None
+            if task.get('pipeline') is not None:
+                pipeline = InputPipeline.from_dict(task['pipeline'])
+                pipeline = pipelines.setdefault(pipeline.key(), pipeline)
+            autotuner = None
+            if task.get('autotuner') is not None:
+                autotuner = autotuners.setdefault(json.dumps(task['autotuner'], sort_keys=True),
+                                                  Autotuner(**task['autotuner']))
+            candidate = training.train_candidate(Network.from_dict(task['network']), train, None, val, None,
+                                                 seed=task['seed'], verbose=0, cutoff=task['cutoff'],
+                                                 restore_best=task.get('restore_best', False), pipeline=pipeline,
+                                                 autotuner=autotuner)
+            result = {'score': float(candidate.score), 'terminated': candidate.terminated, 'stats': candidate.stats}
+        except Exception as exception:
+            result = {'error': repr(exception)}
+        finally:
+            stop.set()
+            K.clear_session()
+        try:
+            queue.complete(worker, task_id, result)
+        except (ConnectionError, EOFError):
+            break
+        evaluated += 1
+    return evaluated
+
+
+def parse_range(text: Optional[str]) -> Tuple[int, Optional[int]]:
+    if text is None:
+        return 0, None
+    start, stop = text.split(':')
+    return int(start or 0), int(stop) if stop else None
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description="Darwini evaluation worker, trains genomes from a work queue")
+    parser.add_argument('--address', required=True, help="coordinator host:port")
+    parser.add_argument('--authkey', required=True, help="key the coordinator's work queue was started with")
+    parser.add_argument('--train', required=True, help="local Dataset path of the training data")
+    parser.add_argument('--val', required=True, help="local Dataset path of the validation data")
+    parser.add_argument('--classes', type=int, required=True)
+    parser.add_argument('--train-range', help="start:stop samples of the training data")
+    parser.add_argument('--val-range', help="start:stop samples of the validation data")
+    args = parser.parse_args()
+    host, port = args.address.rsplit(':', 1)
+    train = Dataset(args.train, args.classes).split(*parse_range(args.train_range))
+    val = Dataset(args.val, args.classes).split(*parse_range(args.val_range))
+    evaluated = run_worker((host, int(port)), args.authkey.encode(), train, val)
+    print("Worker stopped after {} evaluations".format(evaluated))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,46 @@
+import sqlite3
+from typing import Optional
+
+from darwini.individuals.network import Network
+
+
+class FitnessCache:
+    path: str
+    seed: int
+    hits: int
+    misses: int
+
+    def __init__(self, path: str = ':memory:', seed: int = 0) -> None:
+        # Scores are stored per seed: using another seed evaluates every genome once more
+        self.path = path
+        self.seed = seed
+        self.hits = 0
+        self.misses = 0
+        self.connection = sqlite3.connect(path)
+        self.connection.execute('CREATE TABLE IF NOT EXISTS fitness ('
+                                'genome TEXT NOT NULL, seed INTEGER NOT NULL, score REAL NOT NULL, '
+                                'description TEXT, PRIMARY KEY (genome, seed))')
+        self.connection.commit()
+
+    def get(self, network: Network) -> Optional[float]:
+        row = self.connection.execute('SELECT score FROM fitness WHERE genome = ? AND seed = ?',
+                                      (network.genome_hash(), self.seed)).fetchone()
+        if row is None:
+            self.misses += 1
+            return None
+        self.hits += 1
+        return row[0]
+
+    def put(self, network: Network, score: float) -> None:
+        self.connection.execute('INSERT OR REPLACE INTO fitness VALUES (?, ?, ?, ?)',
+                                (network.genome_hash(), self.seed, float(score), str(network)))
+        self.connection.commit()
+
+    def close(self) -> None:
+        self.connection.close()
+
+    def __len__(self) -> int:
+        return self.connection.execute('SELECT COUNT(*) FROM fitness WHERE seed = ?', (self.seed,)).fetchone()[0]
+
+    def __str__(self) -> str:
+        return "Fitness cache hits:{}\tmisses:{}\tstored:{}".format(self.hits, self.misses, len(self))
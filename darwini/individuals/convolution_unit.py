@@ -1,12 +1,12 @@
-import math
 import random
-
-from keras.layers.convolutional import Conv2D, MaxPooling2D
-from keras.models import Sequential
+from typing import TYPE_CHECKING
 
 import darwini.constants as constants
 from darwini.individuals.individual_unit import IndividualUnit
 
+if TYPE_CHECKING:
+    from keras.models import Sequential
+
 
 class ConvolutionUnit(IndividualUnit):
     filters_nbr: int
@@ -15,16 +15,18 @@ class ConvolutionUnit(IndividualUnit):
 
     has_pooling: bool
     pooling_size: int
+    stride: int
 
     input_size: int
 
     def __init__(self, input_size: int, filters_nbr: int, kernel_size: int, activation: str, has_pooling: bool,
-                 pooling_size: int) -> None:
+                 pooling_size: int, stride: int = 1) -> None:
         self.filters_nbr = filters_nbr
         self.kernel_size = kernel_size
         self.activation = activation
         self.has_pooling = has_pooling
         self.pooling_size = pooling_size
+        self.stride = stride
         self.input_size = input_size
 
     @staticmethod
@@ -34,7 +36,8 @@ class ConvolutionUnit(IndividualUnit):
         activation = random.choice(constants.ACTIVATIONS)
         has_pooling = random.random() < constants.POOLING_PROBABILITY
         pooling_size = random.randint(constants.MIN_POOL_SIZE, constants.MAX_POOL_SIZE)
-        return ConvolutionUnit(input_size, filters_nbr, kernel_size, activation, has_pooling, pooling_size)
+        stride = random.randint(constants.MIN_CONV_STRIDE, constants.MAX_CONV_STRIDE)
+        return ConvolutionUnit(input_size, filters_nbr, kernel_size, activation, has_pooling, pooling_size, stride)
 
     def blend(self, partner: 'ConvolutionUnit') -> 'ConvolutionUnit':
         filters_nbr = random.choice([self.filters_nbr, partner.filters_nbr])
@@ -42,7 +45,9 @@ class ConvolutionUnit(IndividualUnit):
         activation = random.choice([self.activation, partner.activation])
         has_pooling = random.choice([self.has_pooling, partner.has_pooling])
         pooling_size = random.choice([self.pooling_size, partner.pooling_size])
-        return ConvolutionUnit(self.input_size, filters_nbr, kernel_size, activation, has_pooling, pooling_size)
+        stride = random.choice([self.stride, partner.stride])
+        return ConvolutionUnit(self.input_size, filters_nbr, kernel_size, activation, has_pooling, pooling_size,
+                               stride)
 
     def mutate(self) -> 'ConvolutionUnit':
         filters_nbr = self.filters_nbr
@@ -53,37 +58,75 @@ class ConvolutionUnit(IndividualUnit):
 
         if random.random() < constants.MUTATION_RATE:
             filters_nbr = max(int(random.gauss(filters_nbr, 2)), 1)
-        return ConvolutionUnit(self.input_size, filters_nbr, kernel_size, activation, has_pooling, pooling_size)
+        return ConvolutionUnit(self.input_size, filters_nbr, kernel_size, activation, has_pooling, pooling_size,
+                               self.stride)
 
-    def add_to_network(self, network: Sequential, data_format='channels_last', input_shape=None) -> None:
+    def add_to_network(self, network: 'Sequential', data_format='channels_last', input_shape=None) -> None:
+        # Keras is only loaded by the processes that build models
+        from keras.layers.convolutional import Conv2D, MaxPooling2D
         if input_shape is not None:
             network.add(
-                Conv2D(self.filters_nbr, (self.kernel_size, self.kernel_size), strides=(1, 1),
+                Conv2D(self.filters_nbr, (self.kernel_size, self.kernel_size), strides=(self.stride, self.stride),
                        data_format=data_format, activation=self.activation, input_shape=input_shape))
         else:
             network.add(
-                Conv2D(self.filters_nbr, (self.kernel_size, self.kernel_size), strides=(1, 1),
+                Conv2D(self.filters_nbr, (self.kernel_size, self.kernel_size), strides=(self.stride, self.stride),
                        data_format=data_format, activation=self.activation))
         if self.has_pooling:
             network.add(
                 MaxPooling2D((self.pooling_size, self.pooling_size), strides=(self.pooling_size, self.pooling_size)))
 
-    def output_size(self):
-        output_size = math.ceil(self.input_size - self.kernel_size + 1)
+    def output_size(self, input_size: int = None) -> int:
+        if input_size is None:
+            input_size = self.input_size
+        output_size = self.conv_size(input_size)
         if self.has_pooling:
-            output_size = math.ceil(output_size / self.pooling_size)
+            # Keras pooling uses 'valid' padding, so incomplete windows are dropped
+            output_size = output_size // self.pooling_size
         return output_size
 
+    def conv_size(self, input_size: int = None) -> int:
+        # Feature map size before pooling, the convolution uses 'valid' padding too
+        if input_size is None:
+            input_size = self.input_size
+        return (input_size - self.kernel_size) // max(self.stride, 1) + 1
+
+    def resized(self, input_size: int) -> 'ConvolutionUnit':
+        return ConvolutionUnit(input_size, self.filters_nbr, self.kernel_size, self.activation, self.has_pooling,
+                               self.pooling_size, self.stride)
+
+    def narrowed(self, filters_nbr: int) -> 'ConvolutionUnit':
+        return ConvolutionUnit(self.input_size, filters_nbr, self.kernel_size, self.activation, self.has_pooling,
+                               self.pooling_size, self.stride)
+
+    def to_dict(self) -> dict:
+        return {'type': 'conv', 'input_size': self.input_size, 'filters_nbr': self.filters_nbr,
+                'kernel_size': self.kernel_size, 'activation': self.activation, 'has_pooling': self.has_pooling,
+                'pooling_size': self.pooling_size, 'stride': self.stride}
+
+    @staticmethod
+    def from_dict(data: dict) -> 'ConvolutionUnit':
+        return ConvolutionUnit(data['input_size'], data['filters_nbr'], data['kernel_size'], data['activation'],
+                               data['has_pooling'], data['pooling_size'], data.get('stride', 1))
+
+    def canonical(self) -> tuple:
+        pooling_size = self.pooling_size if self.has_pooling else 0
+        canonical = 'conv', self.filters_nbr, self.kernel_size, self.activation, self.has_pooling, pooling_size
+        # Unit strides are left out so that genomes saved before strides existed keep their hash
+        return canonical if self.stride == 1 else canonical + (self.stride,)
+
     def __eq__(self, o: 'ConvolutionUnit') -> bool:
         if type(self) != type(o):
             return False
-        equals = self.filters_nbr == o.filters_nbr and self.kernel_size == o.kernel_size \
-                 and self.activation == o.activation and self.has_pooling == o.has_pooling \
-                 and self.pooling_size == o.pooling_size
-        return equals
+        return self.canonical() == o.canonical()
+
+    def __hash__(self) -> int:
+        return hash(self.canonical())
 
     def __str__(self) -> str:
         string = "Conv filters:{}\tsize:{}\tactivation:{}".format(self.filters_nbr, self.kernel_size, self.activation)
+        if self.stride != 1:
+            string += "\tstride:{}".format(self.stride)
         if self.has_pooling:
             string += "\nPooling size:{}".format(self.pooling_size)
         string += "\tOutput size:{}".format(self.output_size())
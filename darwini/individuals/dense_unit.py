@@ -1,11 +1,12 @@
 import random
-
-from keras.layers.core import Dense, Dropout
-from keras.models import Sequential
+from typing import TYPE_CHECKING
 
 import darwini.constants as constants
 from darwini.individuals.individual_unit import IndividualUnit
 
+if TYPE_CHECKING:
+    from keras.models import Sequential
+
 
 class DenseUnit(IndividualUnit):
     size: int
@@ -45,7 +46,11 @@ class DenseUnit(IndividualUnit):
             dropout_rate = max(min(random.gauss(dropout_rate, 0.1), 1), 0)
         return DenseUnit(size, activation, has_dropout, dropout_rate)
 
-    def add_to_network(self, network: Sequential) -> None:
+    def narrowed(self, size: int) -> 'DenseUnit':
+        return DenseUnit(size, self.activation, self.has_dropout, self.dropout_rate)
+
+    def add_to_network(self, network: 'Sequential') -> None:
+        from keras.layers.core import Dense, Dropout
         network.add(Dense(self.size, activation=self.activation))
         if self.has_dropout:
             network.add(Dropout(self.dropout_rate))
@@ -56,8 +61,23 @@ class DenseUnit(IndividualUnit):
             string += "\tdropout:{}".format(self.dropout_rate)
         return string
 
+    def to_dict(self) -> dict:
+        return {'type': 'dense', 'size': self.size, 'activation': self.activation, 'has_dropout': self.has_dropout,
+                'dropout_rate': self.dropout_rate}
+
+    @staticmethod
+    def from_dict(data: dict) -> 'DenseUnit':
+        return DenseUnit(data['size'], data['activation'], data['has_dropout'], data['dropout_rate'])
+
+    def canonical(self) -> tuple:
+        dropout_rate = self.dropout_rate if self.has_dropout else 0.0
+        return 'dense', self.size, self.activation, self.has_dropout, dropout_rate
+
     def __eq__(self, o: 'DenseUnit') -> bool:
         if type(self) != type(o):
             return False
 
-        return self.size == o.size and self.activation == o.activation and self.dropout_rate == o.dropout_rate
+        return self.canonical() == o.canonical()
+
+    def __hash__(self) -> int:
+        return hash(self.canonical())
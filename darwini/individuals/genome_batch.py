@@ -0,0 +1,407 @@
+from typing import Dict, List, Tuple
+
+import numpy as np
+from numpy.core.records import ndarray
+
+import darwini.constants as constants
+from darwini.individuals.convolution_unit import ConvolutionUnit
+from darwini.individuals.dense_unit import DenseUnit
+from darwini.individuals.network import Network, cost_budgets
+
+CONV_FIELDS = ('conv_filters', 'conv_kernel', 'conv_activation', 'conv_pooling', 'conv_pool_size', 'conv_stride')
+DENSE_FIELDS = ('dense_size', 'dense_activation', 'dense_dropout', 'dense_rate')
+
+
+class Genome:
+    # View on one row of a GenomeBatch, nothing is copied until it becomes a Network
+    __slots__ = ('batch', 'index')
+
+    def __init__(self, batch: 'GenomeBatch', index: int) -> None:
+        self.batch = batch
+        self.index = index
+
+    @property
+    def conv_count(self) -> int:
+        return int(self.batch.conv_count[self.index])
+
+    @property
+    def dense_count(self) -> int:
+        return int(self.batch.dense_count[self.index])
+
+    def to_network(self) -> Network:
+        return self.batch.to_network(self.index)
+
+    def __str__(self) -> str:
+        return str(self.to_network())
+
+
+class GenomeBatch:
+    # Structure of arrays: one row per genome, one column per unit slot, slots past the unit counts are unused
+    input_shape: Tuple[int, ...]
+    output_shape: int
+    data_format: str
+    activations: List[str]
+    conv_count: ndarray
+    conv_filters: ndarray
+    conv_kernel: ndarray
+    conv_activation: ndarray
+    conv_pooling: ndarray
+    conv_pool_size: ndarray
+    conv_stride: ndarray
+    dense_count: ndarray
+    dense_size: ndarray
+    dense_activation: ndarray
+    dense_dropout: ndarray
+    dense_rate: ndarray
+
+    def __init__(self, input_shape: Tuple[int, ...], output_shape: int, size: int, conv_slots: int = None,
+                 dense_slots: int = constants.GENOME_DENSE_SLOTS, data_format: str = 'channels_last',
+                 activations: List[str] = None) -> None:
+        self.input_shape = tuple(input_shape)
+        self.output_shape = output_shape
+        self.data_format = data_format
+        self.activations = list(activations) if activations is not None else list(constants.ACTIVATIONS)
+        if conv_slots is None:
+            # Without pooling, generation stacks at most one convolution per pixel above the final size of 8
+            conv_slots = max(min(self.spatial_shape()) - 8, 1)
+        self.conv_count = np.zeros(size, dtype=np.int32)
+        self.conv_filters = np.zeros((size, conv_slots), dtype=np.int32)
+        self.conv_kernel = np.zeros((size, conv_slots), dtype=np.int32)
+        self.conv_activation = np.zeros((size, conv_slots), dtype=np.int32)
+        self.conv_pooling = np.zeros((size, conv_slots), dtype=bool)
+        self.conv_pool_size = np.zeros((size, conv_slots), dtype=np.int32)
+        self.conv_stride = np.ones((size, conv_slots), dtype=np.int32)
+        self.dense_count = np.zeros(size, dtype=np.int32)
+        self.dense_size = np.zeros((size, dense_slots), dtype=np.int32)
+        self.dense_activation = np.zeros((size, dense_slots), dtype=np.int32)
+        self.dense_dropout = np.zeros((size, dense_slots), dtype=bool)
+        self.dense_rate = np.zeros((size, dense_slots), dtype=np.float64)
+
+    @staticmethod
+    def generate(input_shape: Tuple[int, ...], output_shape: int, size: int, rng: np.random.Generator = None,
+                 data_format: str = 'channels_last') -> 'GenomeBatch':
+        # Like Network.generate, genomes are narrowed to the compute budget. Those too deep to fit are drawn again
+        rng = rng if rng is not None else np.random.default_rng()
+        batch, over = GenomeBatch.__draw(input_shape, output_shape, size, rng, data_format).__fit_budget()
+        for _ in range(constants.MAX_GENOME_RESAMPLES):
+            if len(over) == 0:
+                break
+            redrawn, still_over = GenomeBatch.__draw(input_shape, output_shape, len(over), rng,
+                                                     data_format).__fit_budget()
+            batch.assign(over, redrawn)
+            over = over[still_over]
+        return batch
+
+    @staticmethod
+    def __draw(input_shape: Tuple[int, ...], output_shape: int, size: int, rng: np.random.Generator,
+               data_format: str) -> 'GenomeBatch':
+        batch = GenomeBatch(input_shape, output_shape, size, data_format=data_format)
+        conv_shape, dense_shape = batch.conv_filters.shape, batch.dense_size.shape
+        batch.conv_filters[:] = rng.integers(constants.MIN_CONV_FILTERS, constants.MAX_CONV_FILTERS + 1, conv_shape)
+        batch.conv_kernel[:] = rng.integers(constants.MIN_CONV_KERNEL_SIZE, constants.MAX_CONV_KERNEL_SIZE + 1,
+                                            conv_shape)
+        batch.conv_activation[:] = batch.random_activations(rng, conv_shape)
+        batch.conv_pooling[:] = rng.random(conv_shape) < constants.POOLING_PROBABILITY
+        batch.conv_pool_size[:] = rng.integers(constants.MIN_POOL_SIZE, constants.MAX_POOL_SIZE + 1, conv_shape)
+        batch.conv_stride[:] = rng.integers(constants.MIN_CONV_STRIDE, constants.MAX_CONV_STRIDE + 1, conv_shape)
+        # Like Network.generate, convolutions are stacked until the feature map is at most 8 wide
+        small = batch.conv_output_sizes(min(batch.spatial_shape())) <= 8
+        batch.conv_count[:] = np.where(small.any(axis=1), small.argmax(axis=1) + 1, conv_shape[1])
+        batch.dense_count[:] = rng.integers(0, min(10, dense_shape[1]) + 1, size)
+        batch.dense_size[:] = rng.integers(constants.MIN_DENSE_SIZE, constants.MAX_DENSE_SIZE + 1, dense_shape)
+        batch.dense_activation[:] = batch.random_activations(rng, dense_shape)
+        batch.dense_dropout[:] = rng.random(dense_shape) < 0.5
+        batch.dense_rate[:] = np.clip(rng.normal(0.25, 0.2, dense_shape), 0, 0.5)
+        return batch
+
+    @staticmethod
+    def from_networks(networks: List[Network]) -> 'GenomeBatch':
+        if len(networks) == 0:
+            raise ValueError("A genome batch needs at least one network to take its shapes from")
+        first = networks[0]
+        activations = list(constants.ACTIVATIONS)
+        for network in networks:
+            for unit in network.conv_units + network.dense_units:
+                if unit.activation not in activations:
+                    activations.append(unit.activation)
+        conv_slots = max([len(network.conv_units) for network in networks] + [1])
+        dense_slots = max([len(network.dense_units) for network in networks] + [constants.GENOME_DENSE_SLOTS])
+        batch = GenomeBatch(first.input_shape, first.output_shape, len(networks), conv_slots, dense_slots,
+                            first.data_format, activations)
+        for i, network in enumerate(networks):
+            batch.conv_count[i] = len(network.conv_units)
+            for j, unit in enumerate(network.conv_units):
+                batch.conv_filters[i, j] = unit.filters_nbr
+                batch.conv_kernel[i, j] = unit.kernel_size
+                batch.conv_activation[i, j] = activations.index(unit.activation)
+                batch.conv_pooling[i, j] = unit.has_pooling
+                batch.conv_pool_size[i, j] = unit.pooling_size
+                batch.conv_stride[i, j] = unit.stride
+            batch.dense_count[i] = len(network.dense_units)
+            for j, unit in enumerate(network.dense_units):
+                batch.dense_size[i, j] = unit.size
+                batch.dense_activation[i, j] = activations.index(unit.activation)
+                batch.dense_dropout[i, j] = unit.has_dropout
+                batch.dense_rate[i, j] = unit.dropout_rate
+        return batch
+
+    def to_network(self, index: int) -> Network:
+        height, _ = self.spatial_shape()
+        conv_units = []
+        for j in range(self.conv_count[index]):
+            unit = ConvolutionUnit(height, int(self.conv_filters[index, j]), int(self.conv_kernel[index, j]),
+                                   self.activations[self.conv_activation[index, j]],
+                                   bool(self.conv_pooling[index, j]), int(self.conv_pool_size[index, j]),
+                                   int(self.conv_stride[index, j]))
+            conv_units.append(unit)
+            height = unit.output_size()
+        dense_units = [DenseUnit(int(self.dense_size[index, j]), self.activations[self.dense_activation[index, j]],
+                                 bool(self.dense_dropout[index, j]), float(self.dense_rate[index, j]))
+                       for j in range(self.dense_count[index])]
+        return Network(self.input_shape, self.output_shape, self.data_format, conv_units, dense_units)
+
+    def to_networks(self) -> List[Network]:
+        return [self.to_network(i) for i in range(len(self))]
+
+    def spatial_shape(self) -> Tuple[int, int]:
+        if self.data_format == 'channels_first':
+            return self.input_shape[1], self.input_shape[2]
+        return self.input_shape[0], self.input_shape[1]
+
+    def channels(self) -> int:
+        return self.input_shape[0] if self.data_format == 'channels_first' else self.input_shape[2]
+
+    def random_activations(self, rng: np.random.Generator, shape: Tuple[int, ...]) -> ndarray:
+        # Only the configured activations are drawn, whatever else the vocabulary holds
+        indexes = np.array([self.activations.index(activation) for activation in constants.ACTIVATIONS])
+        return indexes[rng.integers(0, len(indexes), shape)]
+
+    def conv_output_sizes(self, input_size: int) -> ndarray:
+        # Feature map size after every slot, computed for every slot whether it is used or not
+        sizes = np.empty(self.conv_kernel.shape, dtype=np.int64)
+        size = np.full(len(self), input_size, dtype=np.int64)
+        for j in range(sizes.shape[1]):
+            size = (size - self.conv_kernel[:, j]) // np.maximum(self.conv_stride[:, j], 1) + 1
+            pooled = self.conv_pooling[:, j] & (self.conv_pool_size[:, j] > 0)
+            size = np.where(pooled, size // np.maximum(self.conv_pool_size[:, j], 1), size)
+            sizes[:, j] = size
+        return sizes
+
+    def conv_sizes(self, input_size: int, outputs: ndarray = None) -> ndarray:
+        # Feature map size of every slot before its pooling
+        outputs = self.conv_output_sizes(input_size) if outputs is None else outputs
+        inputs = np.concatenate([np.full((len(self), 1), input_size), outputs[:, :-1]], axis=1)
+        return (inputs - self.conv_kernel) // np.maximum(self.conv_stride, 1) + 1
+
+    def sizes(self) -> Dict[str, ndarray]:
+        # Feature map sizes every cost is computed from, worked out once and shared between them
+        height, width = self.spatial_shape()
+        output_heights = self.conv_output_sizes(height)
+        output_widths = output_heights if width == height else self.conv_output_sizes(width)
+        conv_heights = self.conv_sizes(height, output_heights)
+        conv_widths = conv_heights if width == height else self.conv_sizes(width, output_widths)
+        return {'output_heights': output_heights, 'output_widths': output_widths, 'conv_heights': conv_heights,
+                'conv_widths': conv_widths, 'flat': self.flat_sizes(output_heights, output_widths)}
+
+    def valid(self) -> ndarray:
+        # Vectorised Network.validate, along with Network.is_within_budget
+        sizes = self.sizes()
+        conv_size = np.minimum(sizes['conv_heights'], sizes['conv_widths'])
+        pooling_ok = ~self.conv_pooling | ((self.conv_pool_size >= 1) & (self.conv_pool_size <= conv_size))
+        conv_ok = (self.conv_filters >= 1) & (self.conv_kernel >= 1) & (self.conv_stride >= 1) & (conv_size >= 1) & \
+            pooling_ok
+        dense_ok = (self.dense_size >= 1) & (~self.dense_dropout | ((self.dense_rate >= 0) & (self.dense_rate < 1)))
+        return (self.conv_count >= 1) & (self.output_shape >= 1) & \
+            np.all(conv_ok | ~self.conv_mask(), axis=1) & np.all(dense_ok | ~self.dense_mask(), axis=1) & \
+            (self.budget_ratios(sizes) <= 1)
+
+    def parameter_counts(self, sizes: Dict[str, ndarray] = None) -> ndarray:
+        # Vectorised Network.parameter_count
+        sizes = self.sizes() if sizes is None else sizes
+        active = self.conv_mask()
+        counts = np.where(active, (self.conv_kernel.astype(np.int64) ** 2 * self.conv_channels() + 1) *
+                          self.conv_filters, 0).sum(axis=1)
+        inputs = sizes['flat']
+        for j in range(self.dense_size.shape[1]):
+            active = j < self.dense_count
+            counts = counts + np.where(active, (inputs + 1) * self.dense_size[:, j], 0)
+            inputs = np.where(active, self.dense_size[:, j], inputs)
+        return counts + (inputs + 1) * self.output_shape
+
+    def multiply_adds(self, sizes: Dict[str, ndarray] = None) -> ndarray:
+        # Vectorised Network.multiply_adds
+        sizes = self.sizes() if sizes is None else sizes
+        counts = np.where(self.conv_mask(), sizes['conv_heights'] * sizes['conv_widths'] *
+                          self.conv_kernel.astype(np.int64) ** 2 * self.conv_channels() * self.conv_filters, 0)
+        counts = counts.sum(axis=1)
+        inputs = sizes['flat']
+        for j in range(self.dense_size.shape[1]):
+            active = j < self.dense_count
+            counts = counts + np.where(active, inputs * self.dense_size[:, j], 0)
+            inputs = np.where(active, self.dense_size[:, j], inputs)
+        return counts + inputs * self.output_shape
+
+    def activation_counts(self, sizes: Dict[str, ndarray] = None) -> ndarray:
+        # Vectorised Network.activation_count
+        sizes = self.sizes() if sizes is None else sizes
+        height, width = self.spatial_shape()
+        filters = self.conv_filters.astype(np.int64)
+        pooled = np.where(self.conv_pooling, sizes['output_heights'] * sizes['output_widths'] * filters, 0)
+        conv = np.where(self.conv_mask(), sizes['conv_heights'] * sizes['conv_widths'] * filters + pooled, 0)
+        dense = np.where(self.dense_mask(), self.dense_size.astype(np.int64) * np.where(self.dense_dropout, 2, 1), 0)
+        return height * width * self.channels() + conv.sum(axis=1) + dense.sum(axis=1) + self.output_shape
+
+    def costs(self, sizes: Dict[str, ndarray] = None) -> Dict[str, ndarray]:
+        sizes = self.sizes() if sizes is None else sizes
+        return {'parameters': self.parameter_counts(sizes), 'multiply_adds': self.multiply_adds(sizes),
+                'activations': self.activation_counts(sizes)}
+
+    def budget_ratios(self, sizes: Dict[str, ndarray] = None) -> ndarray:
+        # Vectorised Network.budget_ratio
+        costs = self.costs(sizes)
+        ratios = [costs[name] / budget for name, budget in cost_budgets().items() if budget is not None]
+        return np.max(np.stack(ratios + [np.zeros(len(self))]), axis=0)
+
+    def within_budget(self) -> ndarray:
+        return self.budget_ratios() <= 1
+
+    def fit_budget(self) -> 'GenomeBatch':
+        return self.__fit_budget()[0]
+
+    def __fit_budget(self) -> Tuple['GenomeBatch', ndarray]:
+        # Vectorised Network.fit_budget: the widths of every row over budget are scaled down until it fits,
+        # rows that no longer change are too deep for the budget and are left as they are, their indexes come back
+        # along with the batch. Only the rows still shrinking are worked on, they are written back after every step
+        batch = self.copy()
+        ratios = batch.budget_ratios()
+        rows = np.flatnonzero(ratios > 1)
+        shrinking, ratios = batch.take(rows), ratios[rows]
+        over = []
+        while len(rows):
+            factors = np.minimum(np.sqrt(1 / ratios), constants.BUDGET_SHRINK_FACTOR)[:, None]
+            conv_filters = np.where(shrinking.conv_mask(),
+                                    np.maximum((shrinking.conv_filters * factors).astype(np.int32), 1),
+                                    shrinking.conv_filters)
+            dense_size = np.where(shrinking.dense_mask(),
+                                  np.maximum((shrinking.dense_size * factors).astype(np.int32), 1),
+                                  shrinking.dense_size)
+            changed = np.any(conv_filters != shrinking.conv_filters, axis=1) | \
+                np.any(dense_size != shrinking.dense_size, axis=1)
+            shrinking.conv_filters, shrinking.dense_size = conv_filters, dense_size
+            batch.conv_filters[rows], batch.dense_size[rows] = conv_filters, dense_size
+            ratios = shrinking.budget_ratios()
+            over.append(rows[~changed & (ratios > 1)])
+            kept = np.flatnonzero(changed & (ratios > 1))
+            rows, shrinking, ratios = rows[kept], shrinking.take(kept), ratios[kept]
+        return batch, np.sort(np.concatenate(over + [np.zeros(0, dtype=np.int64)]))
+
+    def conv_channels(self) -> ndarray:
+        # Input channels of every convolution slot
+        return np.concatenate([np.full((len(self), 1), self.channels()), self.conv_filters[:, :-1]],
+                              axis=1).astype(np.int64)
+
+    def flat_sizes(self, output_heights: ndarray = None, output_widths: ndarray = None) -> ndarray:
+        # Size of the flattened output of the last convolution of every row
+        height, width = self.spatial_shape()
+        output_heights = self.conv_output_sizes(height) if output_heights is None else output_heights
+        output_widths = self.conv_output_sizes(width) if output_widths is None else output_widths
+        last = np.maximum(self.conv_count - 1, 0)[:, None]
+        heights = np.take_along_axis(output_heights, last, axis=1)[:, 0]
+        widths = np.take_along_axis(output_widths, last, axis=1)[:, 0]
+        return np.where(self.conv_count > 0,
+                        heights * widths * np.take_along_axis(self.conv_filters, last, axis=1)[:, 0],
+                        height * width * self.channels())
+
+    def conv_mask(self) -> ndarray:
+        return np.arange(self.conv_filters.shape[1])[None, :] < self.conv_count[:, None]
+
+    def dense_mask(self) -> ndarray:
+        return np.arange(self.dense_size.shape[1])[None, :] < self.dense_count[:, None]
+
+    def mutate(self, rng: np.random.Generator = None) -> 'GenomeBatch':
+        # Same operators as Network.mutate, applied to the whole batch at once
+        rng = rng if rng is not None else np.random.default_rng()
+        batch = self.copy()
+        conv_shape, dense_shape = batch.conv_filters.shape, batch.dense_size.shape
+        mutated = rng.random(conv_shape) < constants.MUTATION_RATE
+        batch.conv_filters[:] = np.where(mutated, np.maximum(np.trunc(rng.normal(batch.conv_filters, 2)), 1),
+                                         batch.conv_filters)
+        batch.dense_dropout ^= rng.random(dense_shape) < 0.2
+        mutated = rng.random(dense_shape) < constants.MUTATION_RATE
+        batch.dense_size[:] = np.where(mutated, np.maximum(np.trunc(rng.normal(batch.dense_size, 2)), 1),
+                                       batch.dense_size)
+        batch.dense_activation[:] = np.where(mutated, batch.random_activations(rng, dense_shape),
+                                             batch.dense_activation)
+        batch.dense_rate[:] = np.where(mutated, np.clip(rng.normal(batch.dense_rate, 0.1), 0, 1), batch.dense_rate)
+        desired = np.clip(np.trunc(rng.normal(batch.dense_count, 1)), 0, dense_shape[1]).astype(np.int32)
+        batch.__resize_dense(desired, rng)
+        return batch.__within_budget_or(self)
+
+    def __resize_dense(self, desired: ndarray, rng: np.random.Generator) -> None:
+        # Vectorised adjust_size: random units are dropped, then one new unit is inserted at random positions
+        slots = np.arange(self.dense_size.shape[1])[None, :]
+        active = self.dense_mask()
+        keys = np.where(active, rng.random(active.shape), np.inf)
+        kept = active & (np.argsort(np.argsort(keys, axis=1), axis=1) < desired[:, None])
+        missing = desired - kept.sum(axis=1)
+        free = ~kept
+        added = free & (np.cumsum(free, axis=1) <= missing[:, None])
+        new_shape = (len(self), 1)
+        self.dense_size[:] = np.where(added, rng.integers(constants.MIN_DENSE_SIZE, constants.MAX_DENSE_SIZE + 1,
+                                                          new_shape), self.dense_size)
+        self.dense_activation[:] = np.where(added, self.random_activations(rng, new_shape), self.dense_activation)
+        self.dense_dropout[:] = np.where(added, rng.random(new_shape) < 0.5, self.dense_dropout)
+        self.dense_rate[:] = np.where(added, np.clip(rng.normal(0.25, 0.2, new_shape), 0, 0.5), self.dense_rate)
+        # Kept units keep their order, added ones land anywhere between them
+        positions = rng.uniform(-1, np.maximum(self.dense_count, 1)[:, None], active.shape)
+        order = np.argsort(np.where(kept, slots, np.where(added, positions, np.inf)), axis=1, kind='stable')
+        for field in DENSE_FIELDS:
+            setattr(self, field, np.take_along_axis(getattr(self, field), order, axis=1))
+        self.dense_count = desired
+
+    def crossover(self, first: ndarray, second: ndarray, rng: np.random.Generator = None) -> 'GenomeBatch':
+        # Uniform crossover of rows first[i] and second[i]: every gene comes from either parent,
+        # slots only one parent uses come from that parent
+        rng = rng if rng is not None else np.random.default_rng()
+        first, second = self.take(first), self.take(second)
+        child = first.copy()
+        for count, fields in (('conv_count', CONV_FIELDS), ('dense_count', DENSE_FIELDS)):
+            first_count, second_count = getattr(first, count), getattr(second, count)
+            setattr(child, count, np.where(rng.random(len(child)) < 0.5, first_count, second_count))
+            slots = np.arange(getattr(first, fields[0]).shape[1])[None, :]
+            for field in fields:
+                from_second = np.where(slots >= first_count[:, None], True,
+                                       np.where(slots >= second_count[:, None], False,
+                                                rng.random(getattr(first, field).shape) < 0.5))
+                setattr(child, field, np.where(from_second, getattr(second, field), getattr(first, field)))
+        return child.__within_budget_or(first)
+
+    def __within_budget_or(self, fallback: 'GenomeBatch') -> 'GenomeBatch':
+        # Offspring are narrowed to the compute budget, those too deep to fit are replaced by their parent's row
+        batch, over = self.__fit_budget()
+        batch.assign(over, fallback.take(over))
+        return batch
+
+    def take(self, indexes: ndarray) -> 'GenomeBatch':
+        batch = GenomeBatch(self.input_shape, self.output_shape, 0, self.conv_filters.shape[1],
+                            self.dense_size.shape[1], self.data_format, self.activations)
+        for field in ('conv_count', 'dense_count') + CONV_FIELDS + DENSE_FIELDS:
+            setattr(batch, field, getattr(self, field)[indexes])
+        return batch
+
+    def assign(self, indexes: ndarray, rows: 'GenomeBatch') -> None:
+        for field in ('conv_count', 'dense_count') + CONV_FIELDS + DENSE_FIELDS:
+            getattr(self, field)[indexes] = getattr(rows, field)
+
+    def copy(self) -> 'GenomeBatch':
+        return self.take(np.arange(len(self)))
+
+    def __len__(self) -> int:
+        return len(self.conv_count)
+
+    def __getitem__(self, index: int) -> Genome:
+        return Genome(self, index)
+
+    def __str__(self) -> str:
+        return "Genome batch size:{}\tconv slots:{}\tdense slots:{}".format(len(self), self.conv_filters.shape[1],
+                                                                            self.dense_size.shape[1])
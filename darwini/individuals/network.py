@@ -1,15 +1,18 @@
+import hashlib
+import json
+import math
 import random
-from typing import List
-
-from fastdtw import fastdtw
-from keras.layers import Flatten, Dense
-from keras.models import Sequential
+from typing import TYPE_CHECKING, Dict, List, Optional, Tuple
 
+import darwini.constants as constants
 from darwini.individuals.convolution_unit import ConvolutionUnit
 from darwini.individuals.dense_unit import DenseUnit
 from darwini.individuals.individual import Individual
 from darwini.individuals.individual_unit import IndividualUnit
 
+if TYPE_CHECKING:
+    from keras.models import Sequential
+
 
 def adjust_size(units: List, desired_len: int, new_unit: IndividualUnit) -> List:
     while desired_len < len(units):
@@ -41,9 +44,14 @@ def blend_lists(self_units: List, partner_units: List) -> List:
 
 
 def blend_convs(self_units: List[ConvolutionUnit], partner_units: List[ConvolutionUnit]) -> List:
+    from fastdtw import fastdtw
+
     def distance(u: int, v: int):
         return abs(u - v)
 
+    if len(self_units) == 0 or len(partner_units) == 0:
+        return list(self_units or partner_units)
+
     self_blocks = []
     partner_blocks = []
     self_output_sizes = [unit.output_size() for unit in self_units]
@@ -74,14 +82,32 @@ def blend_convs(self_units: List[ConvolutionUnit], partner_units: List[Convoluti
         blocks.append(random.choice([self_block, partner_block]))
     # Flatten blocks
     units = [item for sublist in blocks for item in sublist]
-    # Update input sizes
+    # Update input sizes on copies, the units still belong to the parents
     input_size = units[0].output_size()
     for i in range(1, len(units)):
-        units[i].input_size = input_size
+        units[i] = units[i].resized(input_size)
         input_size = units[i].output_size()
     return units
 
 
+def cost_budgets() -> Dict[str, Optional[int]]:
+    # Read on every call so that the limits can be changed at run time, None disables a limit
+    return {'parameters': constants.MAX_NETWORK_PARAMETERS, 'multiply_adds': constants.MAX_NETWORK_MULTIPLY_ADDS,
+            'activations': constants.MAX_NETWORK_ACTIVATIONS}
+
+
+def aligned_distance(self_features: List[List[float]], partner_features: List[List[float]]) -> float:
+    # Layers are aligned as in blend_convs, the distance is averaged over the aligned pairs.
+    # A missing layer stack is aligned against zeros
+    from fastdtw import fastdtw
+
+    if len(self_features) == 0 and len(partner_features) == 0:
+        return 0.
+    width = len((self_features or partner_features)[0])
+    distance, path = fastdtw(self_features or [[0.] * width], partner_features or [[0.] * width], dist=1)
+    return distance / len(path)
+
+
 class Network(Individual):
     input_shape: List[int]
     output_shape: int
@@ -108,7 +134,7 @@ class Network(Individual):
         dense_units = []
         for _ in range(dense_units_nbr):
             dense_units.append(DenseUnit.generate())
-        return Network(input_shape, output_shape, data_format, conv_units, dense_units)
+        return Network(input_shape, output_shape, data_format, conv_units, dense_units).fit_budget()
 
     def __init__(self, input_shape: List[int], output_shape: int, data_format: str,
                  conv_units: List[ConvolutionUnit], dense_units: List[DenseUnit]) -> None:
@@ -121,16 +147,157 @@ class Network(Individual):
     def blend(self, partner: 'Network') -> 'Network':
         conv_units = blend_convs(self.conv_units, partner.conv_units)
         dense_units = blend_lists(self.dense_units, partner.dense_units)
-        return Network(self.input_shape, self.output_shape, self.data_format, conv_units, dense_units)
+        return Network(self.input_shape, self.output_shape, self.data_format, conv_units, dense_units).fit_budget()
 
     def mutate(self) -> 'Network':
         desired_new_dense_len = max(int(random.gauss(len(self.dense_units), 1)), 0)
         conv_units = [conv.mutate() for conv in self.conv_units]
         dense_units = [dense.mutate() for dense in self.dense_units]
         dense_units = adjust_size(dense_units, desired_new_dense_len, DenseUnit.generate())
-        return Network(self.input_shape, self.output_shape, self.data_format, conv_units, dense_units)
+        return Network(self.input_shape, self.output_shape, self.data_format, conv_units, dense_units).fit_budget()
+
+    def distance(self, partner: 'Network') -> float:
+        # Widths and feature map sizes are compared in doublings, so that halving a layer counts the same at any size
+        def conv_features(network: 'Network') -> List[List[float]]:
+            return [[math.log2(max(unit.filters_nbr, 1)), math.log2(max(unit.output_size(), 1))]
+                    for unit in network.conv_units]
+
+        def dense_features(network: 'Network') -> List[List[float]]:
+            return [[math.log2(max(unit.size, 1))] for unit in network.dense_units]
 
-    def compile(self) -> Sequential:
+        return aligned_distance(conv_features(self), conv_features(partner)) + \
+            aligned_distance(dense_features(self), dense_features(partner))
+
+    def spatial_shape(self) -> Tuple[int, int]:
+        if self.data_format == 'channels_first':
+            return self.input_shape[1], self.input_shape[2]
+        return self.input_shape[0], self.input_shape[1]
+
+    def validate(self) -> List[str]:
+        problems = []
+        if self.output_shape < 1:
+            problems.append("Output size {} is not positive".format(self.output_shape))
+        if len(self.conv_units) == 0:
+            problems.append("No convolution unit")
+        height, width = self.spatial_shape()
+        for i, unit in enumerate(self.conv_units):
+            if unit.filters_nbr < 1:
+                problems.append("Conv {}: {} filters".format(i, unit.filters_nbr))
+            if unit.stride < 1:
+                problems.append("Conv {}: stride {}".format(i, unit.stride))
+            conv_size = unit.conv_size(min(height, width))
+            if unit.kernel_size < 1 or conv_size < 1:
+                problems.append("Conv {}: kernel size {} on a {}x{} input".format(i, unit.kernel_size, height, width))
+            elif unit.has_pooling and not 1 <= unit.pooling_size <= conv_size:
+                problems.append("Conv {}: pooling size {} on a {}x{} feature map".format(
+                    i, unit.pooling_size, conv_size, conv_size))
+            height, width = unit.output_size(height), unit.output_size(width)
+        for i, unit in enumerate(self.dense_units):
+            if unit.size < 1:
+                problems.append("Dense {}: size {}".format(i, unit.size))
+            if unit.has_dropout and not 0 <= unit.dropout_rate < 1:
+                problems.append("Dense {}: dropout rate {}".format(i, unit.dropout_rate))
+        return problems
+
+    def parameter_count(self) -> int:
+        height, width = self.spatial_shape()
+        channels = self.input_shape[0] if self.data_format == 'channels_first' else self.input_shape[2]
+        count = 0
+        for unit in self.conv_units:
+            count += (unit.kernel_size * unit.kernel_size * channels + 1) * unit.filters_nbr
+            channels = unit.filters_nbr
+            height, width = unit.output_size(height), unit.output_size(width)
+        inputs = height * width * channels
+        for unit in self.dense_units:
+            count += (inputs + 1) * unit.size
+            inputs = unit.size
+        return count + (inputs + 1) * self.output_shape
+
+    def multiply_adds(self) -> int:
+        # Inference cost of a single sample, pooling and activations are negligible next to it
+        height, width = self.spatial_shape()
+        channels = self.input_shape[0] if self.data_format == 'channels_first' else self.input_shape[2]
+        count = 0
+        for unit in self.conv_units:
+            conv_height, conv_width = unit.conv_size(height), unit.conv_size(width)
+            count += conv_height * conv_width * unit.kernel_size * unit.kernel_size * channels * unit.filters_nbr
+            channels = unit.filters_nbr
+            height, width = unit.output_size(height), unit.output_size(width)
+        inputs = height * width * channels
+        for unit in self.dense_units:
+            count += inputs * unit.size
+            inputs = unit.size
+        return count + inputs * self.output_shape
+
+    def activation_count(self) -> int:
+        # Values kept for the backward pass of a single sample, the input and the convolution outputs dominate
+        height, width = self.spatial_shape()
+        channels = self.input_shape[0] if self.data_format == 'channels_first' else self.input_shape[2]
+        count = height * width * channels
+        for unit in self.conv_units:
+            count += unit.conv_size(height) * unit.conv_size(width) * unit.filters_nbr
+            height, width = unit.output_size(height), unit.output_size(width)
+            if unit.has_pooling:
+                count += height * width * unit.filters_nbr
+        for unit in self.dense_units:
+            count += unit.size * (2 if unit.has_dropout else 1)
+        return count + self.output_shape
+
+    def costs(self) -> Dict[str, int]:
+        return {'parameters': self.parameter_count(), 'multiply_adds': self.multiply_adds(),
+                'activations': self.activation_count()}
+
+    def budget_ratio(self) -> float:
+        # Largest cost over its budget, above 1 the network is over budget
+        costs = self.costs()
+        return max([costs[name] / budget for name, budget in cost_budgets().items() if budget is not None] + [0])
+
+    def is_within_budget(self) -> bool:
+        return self.budget_ratio() <= 1
+
+    def fit_budget(self) -> 'Network':
+        # Every filter count and dense size is scaled down until the costs fit, the architecture stays the same.
+        # Costs grow with the product of consecutive widths, hence the square root
+        network = self
+        ratio = network.budget_ratio()
+        while ratio > 1:
+            factor = min(math.sqrt(1 / ratio), constants.BUDGET_SHRINK_FACTOR)
+            conv_units = [unit.narrowed(max(int(unit.filters_nbr * factor), 1)) for unit in network.conv_units]
+            dense_units = [unit.narrowed(max(int(unit.size * factor), 1)) for unit in network.dense_units]
+            narrowed = Network(self.input_shape, self.output_shape, self.data_format, conv_units, dense_units)
+            if narrowed == network:
+                # Nothing left to narrow, the budget is too small for this architecture
+                break
+            network, ratio = narrowed, narrowed.budget_ratio()
+        return network
+
+    def is_valid(self) -> bool:
+        return len(self.validate()) == 0
+
+    def repair(self) -> 'Network':
+        conv_units = []
+        height, width = self.spatial_shape()
+        for unit in self.conv_units:
+            stride = max(unit.stride, 1)
+            conv_size = (min(height, width) - unit.kernel_size) // stride + 1
+            if unit.kernel_size < 1 or conv_size < 1:
+                continue
+            has_pooling = unit.has_pooling and 1 <= unit.pooling_size <= conv_size
+            unit = ConvolutionUnit(height, max(unit.filters_nbr, 1), unit.kernel_size, unit.activation, has_pooling,
+                                   unit.pooling_size, stride)
+            conv_units.append(unit)
+            height, width = unit.output_size(height), unit.output_size(width)
+        if len(conv_units) == 0:
+            conv_units.append(ConvolutionUnit.generate(height))
+        dense_units = [DenseUnit(unit.size, unit.activation, unit.has_dropout and 0 <= unit.dropout_rate < 1,
+                                 unit.dropout_rate) for unit in self.dense_units if unit.size >= 1]
+        # Dropped pooling layers make the following units more expensive
+        return Network(self.input_shape, self.output_shape, self.data_format, conv_units, dense_units).fit_budget()
+
+    def compile(self) -> 'Sequential':
+        # Genomes are generated, bred and hashed without Keras, it is only loaded to build a model
+        from keras.layers import Flatten, Dense
+        from keras.models import Sequential
         model = Sequential()
         first = True
         for unit in self.conv_units:
@@ -146,9 +313,34 @@ class Network(Individual):
         model.compile('adam', 'categorical_crossentropy', metrics=['accuracy'])
         return model
 
+    def canonical(self) -> tuple:
+        conv_units = tuple(unit.canonical() for unit in self.conv_units)
+        dense_units = tuple(unit.canonical() for unit in self.dense_units)
+        return tuple(self.input_shape), self.output_shape, self.data_format, conv_units, dense_units
+
+    def genome_hash(self) -> str:
+        return hashlib.sha1(repr(self.canonical()).encode('utf-8')).hexdigest()
+
+    def to_dict(self) -> dict:
+        return {'input_shape': list(self.input_shape), 'output_shape': self.output_shape,
+                'data_format': self.data_format, 'conv_units': [unit.to_dict() for unit in self.conv_units],
+                'dense_units': [unit.to_dict() for unit in self.dense_units]}
+
+    @staticmethod
+    def from_dict(data: dict) -> 'Network':
+        conv_units = [ConvolutionUnit.from_dict(unit) for unit in data['conv_units']]
+        dense_units = [DenseUnit.from_dict(unit) for unit in data['dense_units']]
+        return Network(tuple(data['input_shape']), data['output_shape'], data['data_format'], conv_units,
+                       dense_units)
+
     def save(self, filename) -> None:
         with open(filename, "w+") as file:
-            file.write(str(self))
+            json.dump(self.to_dict(), file, indent=2)
+
+    @staticmethod
+    def load(filename) -> 'Network':
+        with open(filename) as file:
+            return Network.from_dict(json.load(file))
 
     def __eq__(self, o: 'Network') -> bool:
         if type(self) != type(o):
@@ -168,6 +360,9 @@ class Network(Individual):
                 return False
         return True
 
+    def __hash__(self) -> int:
+        return hash(self.canonical())
+
     def __str__(self) -> str:
         string = "Network input:{}".format(self.input_shape)
         for conv in self.conv_units:
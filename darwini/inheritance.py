@@ -0,0 +1,82 @@
+from typing import TYPE_CHECKING, List, Optional, Tuple
+
+import numpy as np
+from numpy.core.records import ndarray
+
+from darwini.individuals.convolution_unit import ConvolutionUnit
+from darwini.individuals.dense_unit import DenseUnit
+from darwini.individuals.individual_unit import IndividualUnit
+from darwini.individuals.network import Network
+
+if TYPE_CHECKING:
+    from keras import Sequential
+
+WeightSnapshot = List[List[ndarray]]
+
+
+def weight_snapshot(model: 'Sequential') -> WeightSnapshot:
+    # One entry per layer with weights: the convolutions, the dense units, then the output layer
+    return [layer.get_weights() for layer in model.layers if len(layer.weights) > 0]
+
+
+def save_snapshot(snapshot: WeightSnapshot, path: str) -> None:
+    arrays = {'{}_{}'.format(i, j): array for i, layer in enumerate(snapshot) for j, array in enumerate(layer)}
+    np.savez(path, **arrays)
+
+
+def load_snapshot(path: str) -> WeightSnapshot:
+    with np.load(path) as archive:
+        keys = sorted((tuple(int(part) for part in key.split('_')), key) for key in archive.files)
+        snapshot = []
+        for (i, _), key in keys:
+            while len(snapshot) <= i:
+                snapshot.append([])
+            snapshot[i].append(archive[key])
+    return snapshot
+
+
+def weighted_units(network: Network) -> List[Tuple[str, int, Optional[IndividualUnit]]]:
+    units = [('conv', i, unit) for i, unit in enumerate(network.conv_units)]
+    units += [('dense', i, unit) for i, unit in enumerate(network.dense_units)]
+    units.append(('output', 0, None))
+    return units
+
+
+def same_config(unit: Optional[IndividualUnit], other: Optional[IndividualUnit]) -> bool:
+    if isinstance(unit, ConvolutionUnit) and isinstance(other, ConvolutionUnit):
+        return unit.filters_nbr == other.filters_nbr and unit.kernel_size == other.kernel_size
+    if isinstance(unit, DenseUnit) and isinstance(other, DenseUnit):
+        return unit.size == other.size
+    return unit is None and other is None
+
+
+def fit_array(source: ndarray, target: ndarray) -> ndarray:
+    # Copies the overlapping part of source, the rest keeps the child's fresh initialisation
+    result = np.array(target, copy=True)
+    overlap = tuple(slice(0, min(s, t)) for s, t in zip(source.shape, target.shape))
+    result[overlap] = source[overlap]
+    return result
+
+
+def inherit_weights(network: Network, model: 'Sequential', parents: List[Tuple[Network, WeightSnapshot]]) -> int:
+    layers = [layer for layer in model.layers if len(layer.weights) > 0]
+    parent_layers = [(kind, index, unit, weights) for parent, snapshot in parents
+                     for (kind, index, unit), weights in zip(weighted_units(parent), snapshot)]
+
+    inherited = 0
+    for layer, (kind, index, unit) in zip(layers, weighted_units(network)):
+        # Prefer a parent layer with the same configuration, the closest in depth first,
+        # then fall back on the parent layer at the same depth, sliced or padded to the child's shape
+        exact = [(abs(parent_index - index), weights) for parent_kind, parent_index, parent_unit, weights
+                 in parent_layers if parent_kind == kind and same_config(unit, parent_unit)]
+        same_depth = [weights for parent_kind, parent_index, _, weights in parent_layers
+                      if parent_kind == kind and parent_index == index]
+        if len(exact) > 0:
+            source = min(exact, key=lambda match: match[0])[1]
+        elif len(same_depth) > 0:
+            source = same_depth[0]
+        else:
+            continue
+        layer.set_weights([fit_array(s, t) for s, t in zip(source, layer.get_weights())])
+        inherited += 1
+    return inherited
@@ -0,0 +1,127 @@
+import sqlite3
+import time
+from typing import Callable, List, Tuple
+
+import numpy as np
+from keras.layers import Activation, Flatten, InputLayer
+from keras.models import Sequential
+
+from darwini import constants
+from darwini.individuals.dense_unit import DenseUnit
+from darwini.individuals.network import Network
+
+Layer = Tuple[str, Tuple[int, ...], Callable[[Sequential], None]]
+
+
+def time_model(model: Sequential, input_shape: Tuple[int, ...], batch_size: int, repeats: int, warmup: int) -> float:
+    x = np.ones((batch_size,) + tuple(input_shape), dtype=np.float32)
+    for _ in range(warmup):
+        model(x, training=False)
+    durations = []
+    for _ in range(repeats):
+        start = time.perf_counter()
+        model(x, training=False).numpy()
+        durations.append(time.perf_counter() - start)
+    # The median is robust to the occasional scheduler hiccup
+    return float(np.median(durations))
+
+
+def add_identities(model: Sequential, count: int) -> None:
+    for _ in range(count):
+        model.add(Activation('linear'))
+
+
+def network_layers(network: Network) -> List[Layer]:
+    # One entry per unit as added by add_to_network, keyed by its configuration and input shape
+    height, width = network.spatial_shape()
+    channels = network.input_shape[0] if network.data_format == 'channels_first' else network.input_shape[2]
+
+    def shape(height: int, width: int, channels: int) -> Tuple[int, ...]:
+        return (channels, height, width) if network.data_format == 'channels_first' else (height, width, channels)
+
+    layers = []
+    for unit in network.conv_units:
+        layers.append((repr(('conv', shape(height, width, channels), unit.canonical(), network.data_format)),
+                       shape(height, width, channels),
+                       lambda model, unit=unit: unit.add_to_network(model, network.data_format)))
+        height, width, channels = unit.output_size(height), unit.output_size(width), unit.filters_nbr
+    layers.append((repr(('flatten', shape(height, width, channels))), shape(height, width, channels),
+                   lambda model: model.add(Flatten())))
+    inputs = height * width * channels
+    # Dropout does nothing at inference, only the dense layer is timed
+    units = [DenseUnit(unit.size, unit.activation, False, 0) for unit in network.dense_units]
+    units.append(DenseUnit(network.output_shape, 'relu', False, 0))
+    for unit in units:
+        layers.append((repr(('dense', inputs, unit.size, unit.activation)), (inputs,),
+                       lambda model, unit=unit: unit.add_to_network(model)))
+        inputs = unit.size
+    return layers
+
+
+class LatencyTable:
+    path: str
+    batch_size: int
+    repeats: int
+    warmup: int
+    hits: int
+    misses: int
+
+    def __init__(self, path: str = ':memory:', batch_size: int = constants.LATENCY_BATCH_SIZE,
+                 repeats: int = constants.LATENCY_REPEATS, warmup: int = constants.LATENCY_WARMUP) -> None:
+        # Latencies only hold for the machine they were measured on, use one table per host
+        self.path = path
+        self.batch_size = batch_size
+        self.repeats = repeats
+        self.warmup = warmup
+        self.hits = 0
+        self.misses = 0
+        self.connection = sqlite3.connect(path)
+        self.connection.execute('CREATE TABLE IF NOT EXISTS latency ('
+                                'layer TEXT NOT NULL, batch_size INTEGER NOT NULL, seconds REAL NOT NULL, '
+                                'PRIMARY KEY (layer, batch_size))')
+        self.connection.commit()
+
+    def layer_latency(self, key: str, input_shape: Tuple[int, ...], add_layer: Callable[[Sequential], None]) \
+            -> float:
+        row = self.connection.execute('SELECT seconds FROM latency WHERE layer = ? AND batch_size = ?',
+                                      (key, self.batch_size)).fetchone()
+        if row is not None:
+            self.hits += 1
+            return row[0]
+        self.misses += 1
+        model = Sequential()
+        model.add(InputLayer(input_shape=input_shape))
+        add_layer(model)
+        seconds = time_model(model, input_shape, self.batch_size, self.repeats, self.warmup)
+        self.connection.execute('INSERT OR REPLACE INTO latency VALUES (?, ?, ?)', (key, self.batch_size, seconds))
+        self.connection.commit()
+        return seconds
+
+    def overhead(self) -> float:
+        # Cost of calling a model at all, paid once per network but measured in every single layer timing.
+        # Models of one and two identity layers tell it apart from the dispatch cost every layer pays
+        one = self.layer_latency('identity', (1,), lambda model: add_identities(model, 1))
+        two = self.layer_latency('identity x2', (1,), lambda model: add_identities(model, 2))
+        return max(2 * one - two, 0)
+
+    def estimate(self, network: Network) -> float:
+        overhead = self.overhead()
+        layers = [self.layer_latency(*layer) for layer in network_layers(network)]
+        return overhead + sum(max(seconds - overhead, 0) for seconds in layers)
+
+    def measure(self, network: Network) -> float:
+        return time_model(network.compile(), network.input_shape, self.batch_size, self.repeats, self.warmup)
+
+    def validate(self, network: Network) -> dict:
+        estimated, measured = self.estimate(network), self.measure(network)
+        return {'estimated_s': estimated, 'measured_s': measured, 'relative_error': (estimated - measured) / measured}
+
+    def close(self) -> None:
+        self.connection.close()
+
+    def __len__(self) -> int:
+        return self.connection.execute('SELECT COUNT(*) FROM latency WHERE batch_size = ?',
+                                       (self.batch_size,)).fetchone()[0]
+
+    def __str__(self) -> str:
+        return "Latency table hits:{}\tmisses:{}\tstored:{}".format(self.hits, self.misses, len(self))
@@ -0,0 +1,204 @@
+import math
+import time
+from typing import List, Optional, Tuple, Union
+
+from keras import Input, Model, Sequential
+from keras.callbacks import Callback
+from keras.layers import Activation
+from keras.utils import Sequence
+from numpy.core.records import ndarray
+
+from darwini import constants, training
+from darwini.callbacks import CurveTermination, EpochTimer
+from darwini.candidate import Candidate
+from darwini.dataset import Dataset
+from darwini.individuals.network import Network
+from darwini.pipeline import InputPipeline
+from darwini.sequence import DatasetSequence
+from darwini.telemetry import reset_peak_rss, rss_mb
+
+
+class ModelPacking:
+    size: int
+    max_multiply_adds: int
+
+    def __init__(self, size: int = constants.PACK_SIZE,
+                 max_multiply_adds: int = constants.PACK_MAX_MULTIPLY_ADDS) -> None:
+        # Only networks too small to keep a CPU busy on their own are packed, larger ones still train alone
+        if size < 1:
+            raise ValueError("A pack holds at least one network")
+        self.size = size
+        self.max_multiply_adds = max_multiply_adds
+
+    def packs(self, networks: List[Network]) -> List[List[int]]:
+        # A fused step lasts as long as its slowest network, networks of similar cost are packed together
+        costs = [network.multiply_adds() for network in networks]
+        small = sorted([i for i, cost in enumerate(costs) if cost <= self.max_multiply_adds], key=lambda i: costs[i])
+        packs = [small[start:start + self.size] for start in range(0, len(small), self.size)]
+        return packs + [[i] for i, cost in enumerate(costs) if cost > self.max_multiply_adds]
+
+    def __str__(self) -> str:
+        return "Model packing size:{}\tmax multiply-adds:{}".format(self.size, self.max_multiply_adds)
+
+
+class Head:
+    # Training state of one packed network, the same rules as EarlyStopping, CurveTermination and BestEpoch
+    model: Sequential
+    epochs: int
+    score: float
+    stopped: bool
+    terminated: bool
+    best_loss: float
+    wait: int
+    best_accuracy: float
+    best_epoch: int
+
+    def __init__(self, model: Sequential, termination: Optional[CurveTermination]) -> None:
+        self.model = model
+        self.termination = termination
+        self.epochs = 0
+        self.score = 0.
+        self.stopped = False
+        self.terminated = False
+        self.best_loss = math.inf
+        self.wait = 0
+        self.best_accuracy = -math.inf
+        self.best_epoch = -1
+        self.weights = None
+        self.best_weights = None
+
+
+class PackMonitor(Callback):
+    heads: List[Head]
+    restore_best: bool
+
+    def __init__(self, models: List[Sequential], epochs: int, cutoff: Optional[float], restore_best: bool) -> None:
+        super().__init__()
+        self.heads = [Head(model, CurveTermination(cutoff, epochs) if cutoff is not None else None)
+                      for model in models]
+        self.restore_best = restore_best
+
+    def on_epoch_end(self, epoch, logs=None):
+        logs = logs or {}
+        for i, head in enumerate(self.heads):
+            if head.stopped:
+                continue
+            loss, accuracy = logs['val_head{}_loss'.format(i)], logs['val_head{}_accuracy'.format(i)]
+            head.epochs = epoch + 1
+            head.score = accuracy
+            if self.restore_best and accuracy > head.best_accuracy:
+                head.best_accuracy, head.best_epoch, head.best_weights = accuracy, epoch, head.model.get_weights()
+            if loss < head.best_loss:
+                head.best_loss, head.wait = loss, 0
+            else:
+                head.wait += 1
+            head.terminated = head.termination is not None and head.termination.observe(epoch, accuracy)
+            if head.wait >= constants.EARLY_STOPPING_PATIENCE or head.terminated:
+                # The stopped network goes on training with the others, its result is frozen here
+                head.stopped = True
+                head.weights = head.model.get_weights()
+        if all(head.stopped for head in self.heads):
+            self.model.stop_training = True
+
+    def on_train_end(self, logs=None):
+        for head in self.heads:
+            if self.restore_best and head.best_weights is not None:
+                head.model.set_weights(head.best_weights)
+                head.score = head.best_accuracy
+            elif head.weights is not None:
+                head.model.set_weights(head.weights)
+
+
+class PackedSequence(Sequence):
+    # Every head learns the same targets from the same batches
+    sequence: DatasetSequence
+    heads: int
+
+    def __init__(self, sequence: DatasetSequence, heads: int) -> None:
+        super().__init__()
+        self.sequence = sequence
+        self.heads = heads
+
+    def __len__(self) -> int:
+        return len(self.sequence)
+
+    def __getitem__(self, index: int) -> Tuple[ndarray, List[ndarray]]:
+        x, y = self.sequence[index]
+        return x, [y] * self.heads
+
+    def on_epoch_end(self) -> None:
+        self.sequence.on_epoch_end()
+
+
+def fuse(models: List[Sequential], input_shape: Tuple[int, ...]) -> Model:
+    # One shared input and one named head per network, which have no weights in common. The summed loss
+    # therefore gives every network the gradients it would get alone, and Adam scales every weight on its own
+    inputs = Input(shape=input_shape)
+    outputs = [Activation('linear', name='head{}'.format(i))(model(inputs)) for i, model in enumerate(models)]
+    model = Model(inputs, outputs)
+    model.compile('adam', ['categorical_crossentropy'] * len(models), metrics=['accuracy'])
+    return model
+
+
+def fit_packed(model: Model, heads: int, train_x: Union[ndarray, Dataset], train_y: Optional[ndarray],
+               val_x: Union[ndarray, Dataset], val_y: Optional[ndarray], epochs: int, callbacks: List[Callback],
+               pipeline: InputPipeline = None, verbose: int = 1) -> None:
+    if pipeline is not None:
+        train = pipeline.training(train_x, train_y).map(lambda x, y: (x, (y,) * heads))
+        validation = pipeline.evaluation(val_x, val_y).map(lambda x, y: (x, (y,) * heads))
+        model.fit(train, epochs=epochs, verbose=verbose, validation_data=validation, callbacks=callbacks)
+    elif isinstance(train_x, Dataset):
+        model.fit(PackedSequence(train_x.sequence(constants.BATCH_SIZE, shuffle=True), heads), epochs=epochs,
+                  verbose=verbose, validation_data=PackedSequence(val_x.sequence(constants.BATCH_SIZE), heads),
+                  callbacks=callbacks)
+    else:
+        model.fit(train_x, [train_y] * heads, batch_size=constants.BATCH_SIZE, epochs=epochs, verbose=verbose,
+                  validation_data=(val_x, [val_y] * heads), callbacks=callbacks)
+
+
+def train_pack(networks: List[Network], train_x: Union[ndarray, Dataset], train_y: Optional[ndarray],
+               val_x: Union[ndarray, Dataset], val_y: Optional[ndarray], seeds: List[Optional[int]],
+               cutoff: Optional[float] = None, restore_best: bool = False, pipeline: InputPipeline = None,
+               verbose: int = 1) -> List[Tuple[Optional[Candidate], Optional[str]]]:
+    if len(networks) == 1:
+        try:
+            return [(training.train_candidate(networks[0], train_x, train_y, val_x, val_y, seed=seeds[0],
+                                              verbose=verbose, cutoff=cutoff, restore_best=restore_best,
+                                              pipeline=pipeline), None)]
+        except Exception as exception:
+            return [(None, repr(exception))]
+    results = [(None, None)] * len(networks)
+    models, members = [], []
+    # Packed networks train in the same graph, they all report the peak memory of the whole pack
+    reset_peak_rss()
+    start_rss = rss_mb()
+    start = time.perf_counter()
+    for i, (network, seed) in enumerate(zip(networks, seeds)):
+        # Each network gets the same initial weights as when trained alone
+        try:
+            models.append(training.compile_network(network, seed)[0])
+            members.append(i)
+        except Exception as exception:
+            results[i] = (None, repr(exception))
+    if not members:
+        return results
+    compile_time = (time.perf_counter() - start) / len(members)
+    timer = EpochTimer()
+    monitor = PackMonitor(models, constants.EPOCH_NBR, cutoff, restore_best)
+    try:
+        fit_packed(fuse(models, networks[0].input_shape), len(models), train_x, train_y, val_x, val_y,
+                   constants.EPOCH_NBR, [timer, monitor], pipeline, verbose)
+    except Exception:
+        # A single broken network takes the whole pack down, each one is trained alone to single it out
+        for i in members:
+            results[i] = train_pack([networks[i]], train_x, train_y, val_x, val_y, [seeds[i]], cutoff, restore_best,
+                                    pipeline, verbose)[0]
+        return results
+    for i, head in zip(members, monitor.heads):
+        candidate = Candidate(head.score, networks[i], head.model, terminated=head.terminated)
+        candidate.stats = dict(training.training_stats(compile_time, timer, start_rss),
+                               epoch_s=timer.durations[:head.epochs], epochs=head.epochs, pack_size=len(members))
+        if restore_best:
+            candidate.stats['best_epoch'] = head.best_epoch + 1
+        results[i] = (candidate, None)
+    return results
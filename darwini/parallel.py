@@ -0,0 +1,168 @@
+import multiprocessing
+from concurrent.futures import FIRST_COMPLETED, Future, ProcessPoolExecutor, wait
+from concurrent.futures.process import BrokenProcessPool
+from typing import Callable, List, Optional, Tuple
+
+from numpy.core.records import ndarray
+
+from darwini import constants
+from darwini.autotune import Autotuner
+from darwini.candidate import Candidate
+from darwini.individuals.network import Network
+from darwini.pipeline import InputPipeline
+
+_data = None
+_pipeline = None
+_autotuner = None
+
+
+def _initialize_worker(train_x: ndarray, train_y: ndarray, val_x: ndarray, val_y: ndarray, threads: int,
+                       pipeline: Optional[InputPipeline], autotuner: Optional[Autotuner]) -> None:
+    global _data, _pipeline, _autotuner
+    import tensorflow as tf
+    tf.config.threading.set_intra_op_parallelism_threads(threads)
+    tf.config.threading.set_inter_op_parallelism_threads(1)
+    _data = (train_x, train_y, val_x, val_y)
+    # Built on the first training, then reused by every training of this worker
+    _pipeline = pipeline
+    # Every worker probes batch sizes for itself, its choices come back in the candidates' stats
+    _autotuner = autotuner
+
+
+def _evaluate(network: Network, seed: Optional[int], parents: Optional[List[Candidate]],
+              weights_path: Optional[str], cutoff: Optional[float], restore_best: bool) \
+        -> Tuple[Optional[Candidate], Optional[str]]:
+    import keras.backend as K
+    from darwini import training
+    try:
+        candidate = training.train_candidate(network, *_data, seed=seed, verbose=0, parents=parents, cutoff=cutoff,
+                                             restore_best=restore_best, pipeline=_pipeline,
+                                             autotuner=_autotuner)
+        # Keras models do not cross process boundaries, the weights go through the disk
+        candidate.spill(weights_path)
+    except Exception as exception:
+        return None, repr(exception)
+    finally:
+        K.clear_session()
+    return candidate, None
+
+
+class ParallelEvaluator:
+    workers: int
+    threads_per_worker: int
+    max_tasks_per_worker: Optional[int]
+    transfers_weights: bool = True
+
+    def __init__(self, train_x: ndarray, train_y: ndarray, val_x: ndarray, val_y: ndarray, workers: int,
+                 threads_per_worker: int = None, pipeline: InputPipeline = None, autotuner: Autotuner = None,
+                 max_tasks_per_worker: Optional[int] = constants.WORKER_MAX_TASKS) -> None:
+        if workers < 1:
+            raise ValueError("Parallel evaluation needs at least one worker")
+        self.workers = workers
+        # Without a given thread count, an autotuner probes them before the first workers start
+        self.autotuner = autotuner
+        self.tune_threads = threads_per_worker is None and autotuner is not None
+        if threads_per_worker is None:
+            threads_per_worker = max(multiprocessing.cpu_count() // workers, 1)
+        self.threads_per_worker = threads_per_worker
+        self.data = (train_x, train_y, val_x, val_y)
+        self.pipeline = pipeline
+        # TensorFlow never hands back all the memory of a training, even after clearing its session. Workers are
+        # replaced after this many trainings so that their memory stays bounded, None keeps them for the whole run
+        self.max_tasks_per_worker = max_tasks_per_worker
+        self.pool = None
+        self.pool_tasks = 0
+        self.submitted = {}
+
+    def __start(self, workers: int, network: Network = None) -> ProcessPoolExecutor:
+        if self.tune_threads and network is not None:
+            self.threads_per_worker = self.autotuner.tune_threads(network, workers)
+            self.tune_threads = False
+        # Workers are spawned rather than forked so that each one gets its own TensorFlow runtime
+        return ProcessPoolExecutor(workers, mp_context=multiprocessing.get_context('spawn'),
+                                   initializer=_initialize_worker,
+                                   initargs=self.data + (self.threads_per_worker, self.pipeline, self.autotuner))
+
+    def __submit(self, task: tuple) -> Future:
+        # max_tasks_per_child hangs the executor on Python 3.11, so the whole pool is replaced instead. The old pool
+        # still finishes the tasks it was given, new ones go to fresh workers
+        if self.pool is not None and self.max_tasks_per_worker is not None and \
+                self.pool_tasks >= self.max_tasks_per_worker * self.workers:
+            self.pool.shutdown(wait=False)
+            self.pool = None
+        if self.pool is None:
+            self.pool = self.__start(self.workers, task[0])
+            self.pool_tasks = 0
+        self.pool_tasks += 1
+        future = self.pool.submit(_evaluate, *task)
+        self.submitted[future] = self.pool
+        return future
+
+    def evaluate(self, networks: List[Network], seeds: List[Optional[int]],
+                 parents: List[Optional[List[Candidate]]] = None, weights_paths: List[Optional[str]] = None,
+                 cutoff: float = None, on_result: Callable[[int, Optional[Candidate], Optional[str]], None] = None,
+                 restore_best: bool = False) -> List[Optional[Candidate]]:
+        if parents is None:
+            parents = [None] * len(networks)
+        if weights_paths is None:
+            weights_paths = [None] * len(networks)
+        tasks = [(network, seed, network_parents, weights_path, cutoff, restore_best)
+                 for network, seed, network_parents, weights_path in zip(networks, seeds, parents, weights_paths)]
+        results = [None] * len(networks)
+        crashed = []
+        queued = list(range(len(tasks)))
+        futures = {}
+        # Tasks are handed out as workers free up, so that a recycled pool only gets the ones submitted after it
+        while queued or futures:
+            while queued and len(futures) < self.workers:
+                i = queued.pop(0)
+                futures[self.__submit(tasks[i])] = i
+            done, _ = wait(futures, return_when=FIRST_COMPLETED)
+            for future in done:
+                i = futures.pop(future)
+                pool = self.submitted.pop(future)
+                try:
+                    results[i], error = future.result()
+                except BrokenProcessPool:
+                    # A dead worker breaks every pending future of its pool, the next tasks go to a fresh one
+                    crashed.append(i)
+                    if pool is self.pool:
+                        self.close()
+                    continue
+                if on_result is not None:
+                    on_result(i, results[i], error)
+        if crashed:
+            # The crashed tasks are rerun one by one to find the culprit
+            for i in sorted(crashed):
+                results[i], error = self.__evaluate_isolated(tasks[i])
+                if on_result is not None:
+                    on_result(i, results[i], error)
+        return results
+
+    def submit(self, network: Network, seed: Optional[int], parents: Optional[List[Candidate]],
+               weights_path: Optional[str], cutoff: Optional[float], restore_best: bool = False) -> Future:
+        return self.__submit((network, seed, parents, weights_path, cutoff, restore_best))
+
+    def result(self, future: Future) -> Tuple[Optional[Candidate], Optional[str]]:
+        pool = self.submitted.pop(future)
+        try:
+            return future.result()
+        except BrokenProcessPool:
+            # Every task still in the dead pool fails with it, the next submission starts a fresh one
+            if pool is self.pool:
+                self.close()
+            return None, "Worker process crashed"
+
+    def __evaluate_isolated(self, task: tuple) -> Tuple[Optional[Candidate], Optional[str]]:
+        pool = self.__start(1)
+        try:
+            result = pool.submit(_evaluate, *task).result()
+        except BrokenProcessPool:
+            result = None, "Worker process crashed"
+        pool.shutdown()
+        return result
+
+    def close(self) -> None:
+        if self.pool is not None:
+            self.pool.shutdown()
+            self.pool = None
@@ -0,0 +1,120 @@
+import json
+import math
+from typing import Callable, Dict, List, Optional, Tuple, Union
+
+from darwini.candidate import Candidate
+from darwini.individuals.network import Network
+
+COSTS = {
+    'parameters': Network.parameter_count,
+    'flops': Network.multiply_adds,
+    'activations': Network.activation_count,
+}
+
+
+def dominates(first: Tuple[float, ...], second: Tuple[float, ...]) -> bool:
+    # Every objective is minimised
+    return all(a <= b for a, b in zip(first, second)) and any(a < b for a, b in zip(first, second))
+
+
+def non_dominated_fronts(points: List[Tuple[float, ...]]) -> List[List[int]]:
+    dominated_by = [[] for _ in points]
+    domination_counts = [0] * len(points)
+    for i, first in enumerate(points):
+        for j in range(i + 1, len(points)):
+            if dominates(first, points[j]):
+                dominated_by[i].append(j)
+                domination_counts[j] += 1
+            elif dominates(points[j], first):
+                dominated_by[j].append(i)
+                domination_counts[i] += 1
+    fronts = [[i for i, count in enumerate(domination_counts) if count == 0]]
+    while fronts[-1]:
+        next_front = []
+        for i in fronts[-1]:
+            for j in dominated_by[i]:
+                domination_counts[j] -= 1
+                if domination_counts[j] == 0:
+                    next_front.append(j)
+        fronts.append(sorted(next_front))
+    return fronts[:-1]
+
+
+def crowding_distances(points: List[Tuple[float, ...]], front: List[int]) -> Dict[int, float]:
+    distances = {i: 0.0 for i in front}
+    for objective in range(len(points[front[0]])):
+        ordered = sorted(front, key=lambda i: points[i][objective])
+        low, high = points[ordered[0]][objective], points[ordered[-1]][objective]
+        distances[ordered[0]] = distances[ordered[-1]] = math.inf
+        if high == low or not math.isfinite(high - low):
+            continue
+        for previous, current, following in zip(ordered, ordered[1:], ordered[2:]):
+            distances[current] += (points[following][objective] - points[previous][objective]) / (high - low)
+    return distances
+
+
+def nsga2_order(points: List[Tuple[float, ...]]) -> List[int]:
+    # Best front first, and within a front the least crowded points first to keep the front spread out
+    order = []
+    for front in non_dominated_fronts(points):
+        distances = crowding_distances(points, front)
+        order.extend(sorted(front, key=lambda i: -distances[i]))
+    return order
+
+
+class ParetoSelection:
+    cost_name: str
+    cost: Callable[[Network], float]
+    costs: Dict[str, float]
+    front: List[Candidate]
+
+    def __init__(self, cost: Union[str, Callable[[Network], float]] = 'parameters', cost_name: str = None) -> None:
+        if isinstance(cost, str):
+            if cost not in COSTS:
+                raise ValueError("Unknown cost {}, expected one of {} or a function".format(cost, list(COSTS)))
+            cost_name, cost = cost, COSTS[cost]
+        self.cost_name = cost_name if cost_name is not None else getattr(cost, '__name__', 'cost')
+        self.cost = cost
+        self.costs = {}
+        self.front = []
+
+    def cost_of(self, network: Network) -> float:
+        # Costs may be measured, each genome is only evaluated once
+        genome = network.genome_hash()
+        if genome not in self.costs:
+            self.costs[genome] = float(self.cost(network))
+        return self.costs[genome]
+
+    def objectives(self, candidate: Candidate) -> Tuple[float, float]:
+        score = candidate.score if math.isfinite(candidate.score) else -math.inf
+        return -score, self.cost_of(candidate.network)
+
+    def select(self, candidates: List[Candidate], count: int) -> List[Candidate]:
+        order = nsga2_order([self.objectives(candidate) for candidate in candidates])
+        return [candidates[i] for i in order[:count]]
+
+    def update(self, candidates: List[Candidate]) -> None:
+        # The front is kept across generations, a genome only appears once
+        unique = {}
+        for candidate in self.front + candidates:
+            unique.setdefault(candidate.network.genome_hash(), candidate)
+        candidates = list(unique.values())
+        points = [self.objectives(candidate) for candidate in candidates]
+        front = non_dominated_fronts(points)[0] if candidates else []
+        self.front = sorted([candidates[i] for i in front], key=lambda candidate: self.cost_of(candidate.network))
+
+    def cheapest(self, min_score: float) -> Optional[Candidate]:
+        for candidate in self.front:
+            if candidate.score >= min_score:
+                return candidate
+        return None
+
+    def export(self, path: str) -> None:
+        front = [{'score': float(candidate.score), 'cost': self.cost_of(candidate.network),
+                  'genome': candidate.network.genome_hash(), 'candidate': candidate.to_dict()}
+                 for candidate in self.front]
+        with open(path, 'w') as file:
+            json.dump({'cost': self.cost_name, 'front': front}, file, indent=2)
+
+    def __str__(self) -> str:
+        return "Pareto front size:{}\tcost:{}".format(len(self.front), self.cost_name)
@@ -0,0 +1,145 @@
+import json
+import os
+import random
+from typing import TYPE_CHECKING, Callable, Optional, Tuple, Union
+
+import numpy as np
+from numpy.core.records import ndarray
+
+from darwini import constants
+from darwini.dataset import Dataset
+
+if TYPE_CHECKING:
+    import tensorflow as tf
+
+Example = Tuple['tf.Tensor', 'tf.Tensor']
+
+
+def normalizer(scale: float, classes_nbr: Optional[int]) -> Callable[['tf.Tensor', 'tf.Tensor'], Example]:
+    import tensorflow as tf
+
+    def normalize(x: 'tf.Tensor', y: 'tf.Tensor') -> Example:
+        x = tf.cast(x, tf.float32) / scale
+        # Dataset labels are class indices, array labels are already one-hot
+        y = tf.one_hot(y, classes_nbr) if classes_nbr is not None else tf.cast(y, tf.float32)
+        return x, y
+
+    return normalize
+
+
+def augment(x: 'tf.Tensor', seed: 'tf.Tensor', flip: bool, translate: int, data_format: str) -> 'tf.Tensor':
+    import tensorflow as tf
+
+    # Stateless operations keep the augmentation reproducible whatever the number of parallel calls
+    if data_format == 'channels_first':
+        x = tf.transpose(x, [1, 2, 0])
+    if flip:
+        x = tf.image.stateless_random_flip_left_right(x, seed[:2])
+    if translate > 0:
+        height, width, channels = x.shape
+        x = tf.image.resize_with_crop_or_pad(x, height + 2 * translate, width + 2 * translate)
+        x = tf.image.stateless_random_crop(x, [height, width, channels], seed[2:])
+    if data_format == 'channels_first':
+        x = tf.transpose(x, [2, 0, 1])
+    return x
+
+
+class InputPipeline:
+    # Spec of the tf.data pipeline feeding every candidate training. The data is read and cached once per process,
+    # only the shuffling, normalisation, augmentation and batching stages are set up again for each training
+    cache: Union[bool, str]
+    shuffle_buffer: int
+    flip: bool
+    translate: int
+    data_format: str
+    batch_size: int
+
+    def __init__(self, cache: Union[bool, str] = True, shuffle_buffer: int = constants.PIPELINE_SHUFFLE_BUFFER,
+                 flip: bool = False, translate: int = 0, data_format: str = 'channels_last',
+                 batch_size: int = constants.BATCH_SIZE) -> None:
+        # cache is True to keep the data in memory, a file prefix to keep it on disk or False to read it every epoch.
+        # translate shifts the images by up to that many pixels, flip mirrors half of them horizontally
+        self.cache = cache
+        self.shuffle_buffer = shuffle_buffer
+        self.flip = flip
+        self.translate = translate
+        self.data_format = data_format
+        self.batch_size = batch_size
+        self.sources = {}
+
+    def source(self, x: Union[ndarray, Dataset], y: Optional[ndarray]) \
+            -> Tuple['tf.data.Dataset', float, Optional[int]]:
+        import tensorflow as tf
+
+        # Raw examples, the scale and the number of classes of index labels, built once per data source
+        if id(x) in self.sources:
+            return self.sources[id(x)][1:]
+        if isinstance(x, Dataset):
+            def read():
+                # Memory-mapped pages are read in chunks, the whole set never has to fit in memory at once
+                for start in range(x.start, x.stop, constants.PIPELINE_READ_CHUNK):
+                    stop = min(start + constants.PIPELINE_READ_CHUNK, x.stop)
+                    yield np.asarray(x.x[start:stop]), np.asarray(x.y[start:stop])
+
+            signature = (tf.TensorSpec((None,) + x.x.shape[1:], x.x.dtype), tf.TensorSpec((None,), x.y.dtype))
+            data = tf.data.Dataset.from_generator(read, output_signature=signature).unbatch()
+            scale, classes_nbr = x.scale, x.classes_nbr
+        else:
+            data = tf.data.Dataset.from_tensor_slices((x, y))
+            scale, classes_nbr = 1., None
+        # Arrays are in memory already. Caching comes before normalisation: uint8 inputs take four times less room
+        # than their float version. Every process and source gets its own cache file
+        if self.cache and isinstance(x, Dataset):
+            path = '{}_{}_{}'.format(self.cache, os.getpid(), len(self.sources)) if isinstance(self.cache, str) else ''
+            data = data.cache(path)
+        self.sources[id(x)] = (x, data, scale, classes_nbr)
+        return data, scale, classes_nbr
+
+    def training(self, x: Union[ndarray, Dataset], y: Optional[ndarray], batch_size: int = None) \
+            -> 'tf.data.Dataset':
+        import tensorflow as tf
+
+        # Seeds come from the random state the training was seeded with, so a seeded training sees the same batches
+        data, scale, classes_nbr = self.source(x, y)
+        data = data.shuffle(self.shuffle_buffer, seed=random.randrange(2 ** 31), reshuffle_each_iteration=True)
+        normalize = normalizer(scale, classes_nbr)
+        if self.flip or self.translate > 0:
+            flip, translate, data_format = self.flip, self.translate, self.data_format
+
+            def prepare(example: Example, seed: 'tf.Tensor') -> Example:
+                x, y = normalize(*example)
+                return augment(x, seed, flip, translate, data_format), y
+
+            seeds = tf.data.Dataset.random(seed=random.randrange(2 ** 31)).batch(4)
+            data = tf.data.Dataset.zip((data, seeds)).map(prepare, num_parallel_calls=tf.data.AUTOTUNE)
+        else:
+            data = data.map(normalize, num_parallel_calls=tf.data.AUTOTUNE)
+        return data.batch(batch_size if batch_size is not None else self.batch_size).prefetch(tf.data.AUTOTUNE)
+
+    def evaluation(self, x: Union[ndarray, Dataset], y: Optional[ndarray]) -> 'tf.data.Dataset':
+        import tensorflow as tf
+
+        data, scale, classes_nbr = self.source(x, y)
+        data = data.map(normalizer(scale, classes_nbr), num_parallel_calls=tf.data.AUTOTUNE)
+        return data.batch(self.batch_size).prefetch(tf.data.AUTOTUNE)
+
+    def to_dict(self) -> dict:
+        return {'cache': self.cache, 'shuffle_buffer': self.shuffle_buffer, 'flip': self.flip,
+                'translate': self.translate, 'data_format': self.data_format, 'batch_size': self.batch_size}
+
+    @staticmethod
+    def from_dict(data: dict) -> 'InputPipeline':
+        return InputPipeline(**data)
+
+    def key(self) -> str:
+        return json.dumps(self.to_dict(), sort_keys=True)
+
+    def __getstate__(self) -> dict:
+        # Only the spec crosses process boundaries, each process builds its own pipeline
+        state = dict(self.__dict__)
+        state['sources'] = {}
+        return state
+
+    def __str__(self) -> str:
+        return "Input pipeline cache:{}\tshuffle:{}\tflip:{}\ttranslate:{}\tbatch:{}".format(
+            self.cache, self.shuffle_buffer, self.flip, self.translate, self.batch_size)
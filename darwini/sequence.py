@@ -0,0 +1,32 @@
+import math
+from typing import Tuple
+
+import numpy as np
+from keras.utils import Sequence
+from numpy.core.records import ndarray
+
+from darwini.dataset import Dataset
+
+
+class DatasetSequence(Sequence):
+    dataset: Dataset
+    batch_size: int
+    shuffle: bool
+
+    def __init__(self, dataset: Dataset, batch_size: int, shuffle: bool = False) -> None:
+        super().__init__()
+        self.dataset = dataset
+        self.batch_size = batch_size
+        self.shuffle = shuffle
+        self.indexes = np.arange(len(dataset))
+        self.on_epoch_end()
+
+    def __len__(self) -> int:
+        return math.ceil(len(self.dataset) / self.batch_size)
+
+    def __getitem__(self, index: int) -> Tuple[ndarray, ndarray]:
+        return self.dataset.batch(self.indexes[index * self.batch_size:(index + 1) * self.batch_size])
+
+    def on_epoch_end(self) -> None:
+        if self.shuffle:
+            np.random.shuffle(self.indexes)
@@ -0,0 +1,36 @@
+import math
+from typing import List
+
+from darwini import constants
+
+
+class SuccessiveHalving:
+    min_epochs: int
+    max_epochs: int
+    reduction_factor: int
+
+    def __init__(self, min_epochs: int = constants.HALVING_MIN_EPOCHS, max_epochs: int = constants.EPOCH_NBR,
+                 reduction_factor: int = constants.HALVING_REDUCTION_FACTOR) -> None:
+        if min_epochs < 1 or max_epochs < min_epochs:
+            raise ValueError("Successive halving needs 1 <= min_epochs <= max_epochs")
+        if reduction_factor < 2:
+            raise ValueError("Successive halving needs a reduction factor of at least 2")
+        self.min_epochs = min_epochs
+        self.max_epochs = max_epochs
+        self.reduction_factor = reduction_factor
+
+    def budgets(self) -> List[int]:
+        # Total number of epochs a candidate has been trained for at the end of each rung
+        budgets = []
+        epochs = self.min_epochs
+        while epochs < self.max_epochs:
+            budgets.append(epochs)
+            epochs *= self.reduction_factor
+        budgets.append(self.max_epochs)
+        return budgets
+
+    def survivors(self, candidates_nbr: int) -> int:
+        return max(math.ceil(candidates_nbr / self.reduction_factor), 1)
+
+    def __str__(self) -> str:
+        return "Successive halving budgets:{}\treduction factor:{}".format(self.budgets(), self.reduction_factor)
@@ -0,0 +1,101 @@
+import math
+from typing import Dict, List, Optional, Tuple
+
+import numpy as np
+from numpy.core.records import ndarray
+
+from darwini import constants
+from darwini.individuals.network import Network
+
+
+def features(network: Network) -> ndarray:
+    # Fixed-length encoding: units beyond the last slot are only seen through the depths and parameter count
+    conv_slots = np.zeros((constants.SURROGATE_CONV_SLOTS, 4))
+    height, _ = network.spatial_shape()
+    for i, unit in enumerate(network.conv_units):
+        height = unit.output_size(height)
+        if i < constants.SURROGATE_CONV_SLOTS:
+            conv_slots[i] = [unit.filters_nbr, unit.kernel_size, unit.pooling_size if unit.has_pooling else 0, height]
+    dense_slots = np.zeros((constants.SURROGATE_DENSE_SLOTS, 2))
+    for i, unit in enumerate(network.dense_units[:constants.SURROGATE_DENSE_SLOTS]):
+        dense_slots[i] = [unit.size, unit.dropout_rate if unit.has_dropout else 0]
+    summary = [len(network.conv_units), len(network.dense_units), math.log(max(network.parameter_count(), 1))]
+    return np.concatenate([summary, conv_slots.reshape(-1), dense_slots.reshape(-1)])
+
+
+def ranks(values: ndarray) -> ndarray:
+    order = np.argsort(values, kind='stable')
+    positions = np.empty(len(values))
+    positions[order] = np.arange(len(values))
+    # Tied values share their average rank
+    _, inverse, counts = np.unique(values, return_inverse=True, return_counts=True)
+    return np.bincount(inverse, weights=positions)[inverse] / counts[inverse]
+
+
+def rank_correlation(predicted: List[float], actual: List[float]) -> Optional[float]:
+    if len(predicted) < 2:
+        return None
+    predicted_ranks, actual_ranks = ranks(np.array(predicted)), ranks(np.array(actual))
+    if predicted_ranks.std() == 0 or actual_ranks.std() == 0:
+        return None
+    return float(np.corrcoef(predicted_ranks, actual_ranks)[0, 1])
+
+
+class Surrogate:
+    factor: int
+    alpha: float
+    min_samples: int
+    observations: Dict[str, Tuple[List[float], float]]
+    weights: Optional[ndarray]
+    mean: ndarray
+    scale: ndarray
+    intercept: float
+
+    def __init__(self, factor: int = constants.SURROGATE_FACTOR, alpha: float = constants.SURROGATE_ALPHA,
+                 min_samples: int = constants.SURROGATE_MIN_SAMPLES) -> None:
+        if factor < 1:
+            raise ValueError("The surrogate must draw at least as many candidates as are trained")
+        self.factor = factor
+        self.alpha = alpha
+        self.min_samples = min_samples
+        self.observations = {}
+        self.weights = None
+
+    def add(self, network: Network, score: float) -> None:
+        if not math.isfinite(score):
+            return
+        self.observations[network.genome_hash()] = (features(network).tolist(), float(score))
+
+    def fit(self) -> None:
+        # Ridge regression on standardised features, cheap enough to refit from scratch every generation
+        if len(self.observations) < self.min_samples:
+            return
+        x = np.array([observation[0] for observation in self.observations.values()])
+        y = np.array([observation[1] for observation in self.observations.values()])
+        self.mean = x.mean(axis=0)
+        self.scale = x.std(axis=0)
+        self.scale[self.scale == 0] = 1
+        self.intercept = y.mean()
+        x = (x - self.mean) / self.scale
+        self.weights = np.linalg.solve(x.T @ x + self.alpha * np.eye(x.shape[1]), x.T @ (y - self.intercept))
+
+    def is_ready(self) -> bool:
+        return self.weights is not None
+
+    def predict(self, networks: List[Network]) -> ndarray:
+        x = np.array([features(network) for network in networks])
+        return self.intercept + ((x - self.mean) / self.scale) @ self.weights
+
+    def to_dict(self) -> dict:
+        return {'observations': {genome: [values, score] for genome, (values, score) in self.observations.items()}}
+
+    def restore(self, data: dict) -> None:
+        self.observations = {genome: (values, score) for genome, (values, score) in data['observations'].items()}
+        self.weights = None
+        self.fit()
+
+    def __len__(self) -> int:
+        return len(self.observations)
+
+    def __str__(self) -> str:
+        return "Surrogate samples:{}\tfactor:{}\tready:{}".format(len(self), self.factor, self.is_ready())
@@ -0,0 +1,151 @@
+import abc
+import glob
+import json
+import platform
+import resource
+import time
+from typing import List, Optional
+
+import numpy as np
+
+
+def _status_mb(field: str, pid: str = 'self') -> Optional[float]:
+    try:
+        with open('/proc/{}/status'.format(pid)) as file:
+            for line in file:
+                if line.startswith(field + ':'):
+                    return int(line.split()[1]) / 1024
+    except OSError:
+        pass
+    return None
+
+
+def peak_rss_mb() -> float:
+    # Peak resident set since the last reset_peak_rss, or since the process started where it cannot be reset
+    peak = _status_mb('VmHWM')
+    if peak is not None:
+        return peak
+    # ru_maxrss is in kilobytes on Linux and in bytes on macOS
+    divisor = 1024 * 1024 if platform.system() == 'Darwin' else 1024
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / divisor
+
+
+def rss_mb() -> Optional[float]:
+    return _status_mb('VmRSS')
+
+
+def reset_peak_rss() -> bool:
+    # Only Linux lets a process reset its high-water mark, tells whether peak_rss_mb starts over
+    try:
+        with open('/proc/self/clear_refs', 'w') as file:
+            file.write('5')
+    except OSError:
+        return False
+    return True
+
+
+def children_rss_mb() -> float:
+    # Current resident set of every child process, such as training workers, 0 where /proc cannot tell
+    pids = []
+    for path in glob.glob('/proc/self/task/*/children'):
+        try:
+            with open(path) as file:
+                pids += file.read().split()
+        except OSError:
+            continue
+    return sum(_status_mb('VmRSS', pid) or 0. for pid in pids)
+
+
+def score_summary(scores: List[float]) -> dict:
+    # Same statistics as pandas' describe()
+    scores = np.array([score for score in scores if score is not None and np.isfinite(score)], dtype=float)
+    if len(scores) == 0:
+        return {'count': 0}
+    quartiles = np.percentile(scores, [25, 50, 75])
+    return {'count': len(scores), 'mean': float(scores.mean()), 'std': float(scores.std(ddof=1)) if len(scores) > 1
+            else 0.0, 'min': float(scores.min()), '25%': float(quartiles[0]), '50%': float(quartiles[1]),
+            '75%': float(quartiles[2]), 'max': float(scores.max())}
+
+
+class Sink(abc.ABC):
+    @abc.abstractmethod
+    def write(self, event: dict) -> None:
+        pass
+
+    def close(self) -> None:
+        pass
+
+
+class ConsoleSink(Sink):
+    # Human readable lines, events without a format are not printed
+    formats = {
+        'resumed': "Resuming after generation {generation} with {results} evaluated candidates",
+        'candidate:restored': "Generation {generation} : Model {index}/{count} restored from checkpoint",
+        'candidate:cached': "Generation {generation} : Model {index}/{count} already evaluated",
+        'candidate:terminated': "Generation {generation} : Model stopped at {score} below cutoff {cutoff}",
+        'candidate:failed': "Generation {generation} : Model {index}/{count} failed: {error}",
+        'training': "Generation {generation} : Training model {index}/{count}",
+        'worker_lost': "Work queue : task {task} lost worker {worker}, reassigning it",
+        'parallel_training': "Generation {generation} : Training {models} models on {workers} workers",
+        'packed_training': "Generation {generation} : Training {models} models together, {indexes} of {count}",
+        'rung_training': "Generation {generation} : Rung {rung} training model {index}/{count} up to epoch {epochs}",
+        'retry': "Generation {generation} : retrying {failed} failed models",
+        'dropped': "Generation {generation} : giving up on {failed} models after {round} retries",
+        'surrogate_screening': "Generation {generation} : Surrogate kept {kept} of {drawn} children",
+        'surrogate_correlation': "Generation {generation} : Surrogate rank correlation {correlation} over {models} "
+                                 "models",
+        'generation': "Generation {generation} took {duration_s:.0f}s\n"
+                      "Genomes repaired:{repaired_genomes}\trejected:{rejected_genomes}\t"
+                      "failed trainings:{failed_trainings}\tterminated trainings:{terminated_trainings}\n"
+                      "Scores {scores}",
+        'fitness_cache': "Fitness cache hits:{hits}\tmisses:{misses}\tstored:{stored}",
+        'latency_table': "Latency table hits:{hits}\tmisses:{misses}\tstored:{stored}",
+        'pareto_front': "Pareto front size:{size}\tcost:{cost}",
+        'surrogate': "Surrogate samples:{samples}\tfactor:{factor}\tready:{ready}",
+        'autotune_class': "Generation {generation} : Batch size {batch_size} for architecture class "
+                          "{architecture_class}",
+        'autotune': "Autotuner classes:{classes}\tthreads:{threads}",
+        'convergence': "Diversity:{diversity:.2f}\tnext offspring:{offspring}\timprovement per hour:"
+                       "{improvement_per_hour}\tstalled:{stalled}\tconverged:{converged}",
+    }
+
+    def write(self, event: dict) -> None:
+        name = event['event']
+        if 'status' in event and "{}:{}".format(name, event['status']) in self.formats:
+            name = "{}:{}".format(name, event['status'])
+        if name in self.formats:
+            print(self.formats[name].format(**event))
+
+
+class JsonLinesSink(Sink):
+    path: str
+
+    def __init__(self, path: str) -> None:
+        self.path = path
+        self.file = open(path, 'a')
+
+    def write(self, event: dict) -> None:
+        # Flushed on every event so that a crashed run still leaves its history behind
+        self.file.write(json.dumps(event) + '\n')
+        self.file.flush()
+
+    def close(self) -> None:
+        self.file.close()
+
+
+class Telemetry:
+    sinks: List[Sink]
+
+    def __init__(self, sinks: List[Sink] = None) -> None:
+        self.sinks = sinks if sinks is not None else [ConsoleSink()]
+
+    def emit(self, event: str, generation: Optional[int] = None, **fields) -> None:
+        record = dict(fields, event=event, time=time.time())
+        if generation is not None:
+            record['generation'] = generation
+        for sink in self.sinks:
+            sink.write(record)
+
+    def close(self) -> None:
+        for sink in self.sinks:
+            sink.close()
@@ -0,0 +1,125 @@
+import random
+import time
+from typing import TYPE_CHECKING, List, Optional, Tuple, Union
+
+import numpy as np
+from numpy.core.records import ndarray
+
+from darwini import constants
+from darwini.autotune import Autotuner, architecture_class
+from darwini.candidate import Candidate
+from darwini.dataset import Dataset
+from darwini.individuals.network import Network
+from darwini.inheritance import inherit_weights
+from darwini.pipeline import InputPipeline
+from darwini.telemetry import peak_rss_mb, reset_peak_rss, rss_mb
+
+if TYPE_CHECKING:
+    from keras import Sequential
+    from keras.callbacks import Callback
+
+    from darwini.callbacks import EpochTimer
+
+
+def evaluation_seed(network: Network, seed: int) -> int:
+    return (int(network.genome_hash()[:8], 16) ^ seed) & 0xffffffff
+
+
+def seed_everything(seed: int) -> None:
+    import tensorflow as tf
+    random.seed(seed)
+    np.random.seed(seed)
+    tf.random.set_seed(seed)
+
+
+def fit(model: 'Sequential', train_x: Union[ndarray, Dataset], train_y: Optional[ndarray],
+        val_x: Union[ndarray, Dataset], val_y: Optional[ndarray], epochs: int, initial_epoch: int = 0,
+        verbose: int = 1, callbacks: List['Callback'] = None, pipeline: InputPipeline = None,
+        batch_size: int = None) -> float:
+    from keras.callbacks import EarlyStopping
+    early_stopper = EarlyStopping(patience=constants.EARLY_STOPPING_PATIENCE)
+    callbacks = [early_stopper] + (callbacks or [])
+    if pipeline is not None:
+        validation = pipeline.evaluation(val_x, val_y)
+        model.fit(pipeline.training(train_x, train_y, batch_size), epochs=epochs, initial_epoch=initial_epoch,
+                  verbose=verbose, validation_data=validation, callbacks=callbacks)
+        return model.evaluate(validation, verbose=0)[1]
+    batch_size = batch_size if batch_size is not None else constants.BATCH_SIZE
+    if isinstance(train_x, Dataset):
+        validation = val_x.sequence(batch_size)
+        model.fit(train_x.sequence(batch_size, shuffle=True), epochs=epochs, initial_epoch=initial_epoch,
+                  verbose=verbose, validation_data=validation, callbacks=callbacks)
+        return model.evaluate(validation, verbose=0)[1]
+    model.fit(train_x, train_y, batch_size=batch_size, epochs=epochs, initial_epoch=initial_epoch,
+              verbose=verbose, validation_data=(val_x, val_y), callbacks=callbacks)
+    score = model.evaluate(val_x, val_y, verbose=0)
+    return score[1]
+
+
+def compile_network(network: Network, seed: int = None, parents: List[Candidate] = None) \
+        -> Tuple['Sequential', int]:
+    if seed is not None:
+        seed_everything(seed)
+    model = network.compile()
+    epochs = constants.EPOCH_NBR
+    if parents:
+        snapshots = [(parent.network, parent.trained_weights()) for parent in parents]
+        snapshots = [(parent, weights) for parent, weights in snapshots if weights is not None]
+        # Children starting from their parents' trained weights only need fine-tuning
+        if inherit_weights(network, model, snapshots) > 0:
+            epochs = constants.INHERITED_EPOCH_NBR
+    return model, epochs
+
+
+def train_candidate(network: Network, train_x: Union[ndarray, Dataset], train_y: Optional[ndarray],
+                    val_x: Union[ndarray, Dataset], val_y: Optional[ndarray], seed: int = None, verbose: int = 1,
+                    parents: List[Candidate] = None, cutoff: Optional[float] = None,
+                    restore_best: bool = False, pipeline: InputPipeline = None,
+                    autotuner: Autotuner = None) -> Candidate:
+    from darwini.callbacks import BestEpoch, CurveTermination, EpochTimer
+    batch_size, tuning = None, None
+    if autotuner is not None:
+        # Probed before the seeded compilation, the probe leaves the training itself untouched
+        batch_size, tuning = autotuner.batch_size(network)
+    # The peak memory in the stats is the one of this training, not of every training the process ran before
+    reset_peak_rss()
+    start_rss = rss_mb()
+    start = time.perf_counter()
+    model, epochs = compile_network(network, seed, parents)
+    compile_time = time.perf_counter() - start
+    timer = EpochTimer()
+    callbacks = [timer]
+    termination = None
+    if cutoff is not None:
+        termination = CurveTermination(cutoff, epochs)
+        callbacks.append(termination)
+    best_epoch = None
+    if restore_best:
+        best_epoch = BestEpoch()
+        callbacks.append(best_epoch)
+    score = fit(model, train_x, train_y, val_x, val_y, epochs, verbose=verbose, callbacks=callbacks,
+                pipeline=pipeline, batch_size=batch_size)
+    terminated = termination is not None and termination.terminated
+    candidate = Candidate(score, network, model, terminated=terminated)
+    candidate.stats = training_stats(compile_time, timer, start_rss)
+    if best_epoch is not None:
+        candidate.stats['best_epoch'] = best_epoch.best_epoch + 1
+    if autotuner is not None:
+        candidate.stats.update(autotune_stats(network, batch_size, tuning))
+    return candidate
+
+
+def training_stats(compile_time: float, timer: 'EpochTimer', start_rss: Optional[float] = None) -> dict:
+    stats = {'compile_s': compile_time, 'epoch_s': timer.durations, 'epochs': len(timer.durations),
+             'peak_rss_mb': peak_rss_mb()}
+    if start_rss is not None:
+        # Memory the process held before the training is left out, what remains is the training's own
+        stats['peak_rss_growth_mb'] = stats['peak_rss_mb'] - start_rss
+    return stats
+
+
+def autotune_stats(network: Network, batch_size: int, tuning: Optional[dict]) -> dict:
+    stats = {'batch_size': batch_size, 'architecture_class': architecture_class(network)}
+    if tuning is not None:
+        stats['autotune'] = tuning
+    return stats
@@ -1,15 +1,13 @@
-import keras
 import keras.backend as K
-import pandas as pd
-from keras.callbacks import EarlyStopping
 from keras.datasets import mnist
 
-from darwini import constants
 from darwini.breeder import Breeder
+from darwini.convergence import Convergence
+from darwini.dataset import Dataset
+from darwini.telemetry import ConsoleSink, JsonLinesSink, Telemetry
 
 num_classes = 10
 scores = []
-summaries = []
 
 # input image dimensions
 img_rows, img_cols = 28, 28
@@ -21,38 +19,33 @@ x_train = x_train.reshape(x_train.shape[0], img_rows, img_cols, 1)
 x_val = x_val.reshape(x_val.shape[0], img_rows, img_cols, 1)
 input_shape = (img_rows, img_cols, 1)
 
-x_train = x_train.astype('float32')
-x_val = x_val.astype('float32')
-x_train /= 255
-x_val /= 255
-
-# convert class vectors to binary class matrices
-y_train = keras.utils.to_categorical(y_train, num_classes)
-y_val = keras.utils.to_categorical(y_val, num_classes)
+# keep uint8 images in memory-mapped files, they are normalised batch by batch during training
+train = Dataset.create('mnist_train', x_train, y_train, num_classes)
+val = Dataset.create('mnist_val', x_val, y_val, num_classes)
 
 # split validation data to obtain test data
-x_test = x_val[8000:]
-y_test = y_val[8000:]
-x_val = x_val[:8000]
-y_val = y_val[:8000]
-
-print('x_train shape:', x_train.shape)
-print(x_train.shape[0], 'train samples')
-print(x_val.shape[0], 'validation samples')
-print(x_test.shape[0], 'test samples')
-
-breeder = Breeder(x_train, y_train, x_val, y_val)
+test = val.split(8000)
+val = val.split(0, 8000)
+
+print('x_train shape:', train.shape)
+print(len(train), 'train samples')
+print(len(val), 'validation samples')
+print(len(test), 'test samples')
+
+# every candidate and generation is also logged as JSON lines for later analysis
+telemetry = Telemetry([ConsoleSink(), JsonLinesSink('mnist_events.jsonl')])
+# trained weights are kept on disk so that the champion is scored and exported without being trained again
+breeder = Breeder.from_datasets(train, val, telemetry=telemetry, keep_weights=True, restore_best=True,
+                                convergence=Convergence(max_generations=10))
 K.clear_session()
-for i in range(3):
-    _, network, _ = breeder.generation()
-    model = network.compile()
-    early_stopper = EarlyStopping(patience=3)
-    model.fit(x_train, y_train, batch_size=constants.BATCH_SIZE, epochs=constants.EPOCH_NBR, verbose=1,
-              validation_data=(x_val, y_val), callbacks=[early_stopper])
-    _, score = model.evaluate(x_test, y_test, verbose=1)
+# the run stops by itself once the scores no longer improve enough for the compute spent,
+# or after at most 10 generations
+while not breeder.converged():
+    breeder.generation()
+    champion = breeder.champion()
+    score = champion.evaluate(test)
     scores.append(score)
-    summary = pd.DataFrame([e[0] for e in breeder.population]).describe()
-    print(summary)
-    summaries.append(summary)
-    print("Best model score of generation {} is {}".format(i, score))
+    print("Best model score of generation {} is {}".format(breeder.generation_nbr, score))
     K.clear_session()
+champion.export('mnist_champion.keras')
+breeder.close()